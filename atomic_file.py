@@ -0,0 +1,20 @@
+import os
+
+
+def write_atomic(path: str, content: str, durable: bool = False):
+    """
+    Replace the file at path with content in one step.
+    The content goes to a temp file next to it first, so a reader (or a crash mid-write) never sees a half written file.
+
+    Args:
+        path (str): File to write
+        content (str): The file's new content
+        durable (bool, optional): fsync the temp file before swapping it in, so the new content survives a power cut too
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        file.write(content)
+        if durable:
+            file.flush()
+            os.fsync(file.fileno())
+    os.replace(temp_path, path)
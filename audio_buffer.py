@@ -0,0 +1,103 @@
+import numpy as np
+
+WHISPER_SAMPLE_RATE = 16000
+
+
+class AudioRingBuffer:
+    """
+    Preallocated ring buffer of int16 samples for microphone capture.
+
+    Writing copies the frame straight into the preallocated array instead of collecting a list of byte strings
+    and joining them at the end. If the reader falls behind (or nothing reads until the recording is over)
+    the buffer doubles in size instead of overwriting unread audio.
+    Samples also have an absolute position (counted from the first sample ever written), so a reader can copy out
+    a span it marked earlier, e.g. a speech segment, with copy_range.
+    """
+
+    def __init__(self, capacity: int):
+        """
+        Args:
+            capacity (int): Number of int16 samples to preallocate (all channels counted)
+        """
+        self.data = np.zeros(max(1, capacity), dtype=np.int16)
+        self.start = 0 # Index in data of the oldest unread sample
+        self.size = 0 # Number of unread samples
+        self.position = 0 # Absolute position of the oldest unread sample
+
+    def __len__(self):
+        return self.size
+
+    def write(self, frame: bytes):
+        """Append a raw int16 frame as read from PyAudio"""
+        samples = np.frombuffer(frame, dtype=np.int16)
+        if self.size + len(samples) > len(self.data):
+            self._grow(self.size + len(samples))
+        end = (self.start + self.size) % len(self.data)
+        first_part = min(len(samples), len(self.data) - end)
+        self.data[end:end + first_part] = samples[:first_part]
+        self.data[:len(samples) - first_part] = samples[first_part:]
+        self.size += len(samples)
+
+    def read_all(self) -> np.ndarray:
+        """Returns every unread sample in order and empties the buffer"""
+        samples = self._copy(0, self.size)
+        self.position += self.size
+        self.start = 0
+        self.size = 0
+        return samples
+
+    def copy_range(self, start: int, end: int) -> np.ndarray:
+        """Returns a copy of the unread samples between two absolute positions, leaving them in the buffer"""
+        if start < self.position or end > self.position + self.size or start > end:
+            raise ValueError(f"Samples {start}-{end} aren't in the buffer (it holds {self.position}-{self.position + self.size})")
+        return self._copy(start - self.position, end - start)
+
+    def discard_before(self, position: int):
+        """Drops the unread samples before an absolute position, freeing their space for new frames"""
+        count = min(max(0, position - self.position), self.size)
+        self.start = (self.start + count) % len(self.data)
+        self.size -= count
+        self.position += count
+
+    def _copy(self, offset: int, count: int) -> np.ndarray:
+        first = (self.start + offset) % len(self.data)
+        end = first + count
+        if end <= len(self.data):
+            return self.data[first:end].copy()
+        return np.concatenate((self.data[first:], self.data[:end - len(self.data)]))
+
+    def _grow(self, needed: int):
+        capacity = len(self.data)
+        while capacity < needed:
+            capacity *= 2
+        unread = self._copy(0, self.size)
+        self.data = np.zeros(capacity, dtype=np.int16)
+        self.data[:len(unread)] = unread
+        self.start = 0
+
+
+def to_whisper_input(samples: np.ndarray, channels: int, rate: int) -> np.ndarray:
+    """
+    Convert captured int16 samples into what Whisper expects: 16 kHz mono float32 in [-1, 1].
+
+    Args:
+        samples (np.ndarray): Interleaved int16 samples
+        channels (int): Number of interleaved channels
+        rate (int): Sample rate of the capture
+
+    Returns:
+        np.ndarray: 16 kHz mono float32 samples
+    """
+    mono = samples.reshape(-1, channels).mean(axis=1, dtype=np.float32) / 32768.0
+    if rate == WHISPER_SAMPLE_RATE or len(mono) == 0:
+        return mono.astype(np.float32)
+
+    ratio = rate / WHISPER_SAMPLE_RATE
+    if ratio > 1:
+        # Average over the span of each output sample first so higher frequencies don't alias into the speech band
+        width = int(round(ratio))
+        if width > 1:
+            mono = np.convolve(mono, np.ones(width, dtype=np.float32) / width, mode="same")
+    output_length = int(len(mono) / ratio)
+    positions = np.arange(output_length, dtype=np.float64) * ratio
+    return np.interp(positions, np.arange(len(mono)), mono).astype(np.float32)
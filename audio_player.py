@@ -7,16 +7,20 @@ import threading
 import keyboard
 import wave
 import pyaudio
+import numpy as np
 import soundfile as sf
 from mutagen.mp3 import MP3
 from pydub import AudioSegment
 from rich import print
 
+from voice_activity import EnergyVAD
+from audio_buffer import AudioRingBuffer, to_whisper_input, WHISPER_SAMPLE_RATE
+
 class AudioManager:
 
     # Variables for recording audio from mic
     is_recording = False
-    audio_frames = []
+    audio_frames = None
     audio_format = pyaudio.paInt16
     channels = 2
     rate = 44100
@@ -122,22 +126,31 @@ class AudioManager:
         return output_file
     
     def start_recording(self, stream):
-        self.audio_frames = []
+        # Frames are copied straight into a preallocated buffer (30 seconds, it grows if we talk for longer)
+        self.audio_frames = AudioRingBuffer(self.rate * self.channels * 30)
         while self.is_recording:
-            data = stream.read(self.chunk)
-            self.audio_frames.append(data)
+            data = stream.read(self.chunk, exception_on_overflow=False)
+            self.audio_frames.write(data)
         print("[red]DONE RECORDING!")
 
-    def record_audio(self, end_recording_key='=', audio_device=None):
-        # Records audio from an audio input device.
-        # Example device names are "Line In (Realtek(R) Audio)", "Sample (TC-Helicon GoXLR)", or just leave empty to use default mic
-        # For some reason this doesn't work on the Broadcast GoXLR Mix, the other 3 GoXLR audio inputs all work fine.
-        # Both Azure Speech-to-Text AND this script have issues listening to Broadcast Stream Mix, so just ignore it.
-        audio = pyaudio.PyAudio()
-        
+    def archive_recording(self, samples, rate):
+        # Saves a recording to a WAV file under personal/ on a background thread, so it's never on the transcription path
+        def write_wav():
+            filename = f"mic_recording_{int(time.time())}.wav"
+            filename = os.path.join(os.path.abspath(os.curdir), "personal", filename)
+            wave_file = wave.open(filename, 'wb')
+            wave_file.setnchannels(self.channels)
+            wave_file.setsampwidth(pyaudio.get_sample_size(self.audio_format))
+            wave_file.setframerate(rate)
+            wave_file.writeframes(samples.tobytes())
+            wave_file.close()
+        threading.Thread(target=write_wav, daemon=True).start()
+
+    def open_input_stream(self, audio, audio_device=None):
+        # Opens a PyAudio input stream on the given device (or the default mic), picking a sample rate the device supports
         if audio_device is None:
             # If no audio_device is provided, use the default mic
-            audio_stream = audio.open(format=self.audio_format, channels=self.channels, rate=self.rate, input=True, frames_per_buffer=self.chunk)
+            return audio.open(format=self.audio_format, channels=self.channels, rate=self.rate, input=True, frames_per_buffer=self.chunk)
         else:
             # If an audio device was provided, find its index
             device_index = None
@@ -160,11 +173,22 @@ class AudioManager:
                 raise ValueError(f"Device '{audio_device}' not found")
             if self.rate is None:
                 raise ValueError(f"No supported sample rate found for device '{audio_device}'")
-            audio_stream = audio.open(format=self.audio_format, channels=self.channels, rate=self.rate, input=True, input_device_index=device_index, frames_per_buffer=self.chunk)
+            return audio.open(format=self.audio_format, channels=self.channels, rate=self.rate, input=True, input_device_index=device_index, frames_per_buffer=self.chunk)
+
+    def record_audio(self, end_recording_key='=', audio_device=None, archive=False):
+        # Records audio from an audio input device.
+        # Example device names are "Line In (Realtek(R) Audio)", "Sample (TC-Helicon GoXLR)", or just leave empty to use default mic
+        # For some reason this doesn't work on the Broadcast GoXLR Mix, the other 3 GoXLR audio inputs all work fine.
+        # Both Azure Speech-to-Text AND this script have issues listening to Broadcast Stream Mix, so just ignore it.
+        # Returns the recording as a 16 kHz mono float32 numpy array that can go straight into WhisperManager.audio_to_text.
+        # If archive is True the original recording is also saved as a WAV under personal/, in the background.
+        audio = pyaudio.PyAudio()
+        audio_stream = self.open_input_stream(audio, audio_device)
                     
         # Start recording an a second thread
         self.is_recording = True
-        threading.Thread(target=self.start_recording, args=(audio_stream,)).start()
+        recording_thread = threading.Thread(target=self.start_recording, args=(audio_stream,))
+        recording_thread.start()
 
         # Wait until end key is pressed
         while True:
@@ -173,21 +197,66 @@ class AudioManager:
             time.sleep(0.05) # Add this to reduce CPU usage
         
         self.is_recording = False
-        time.sleep(0.1) # Just for safety, no clue if this is needed
-
-        filename = f"mic_recording_{int(time.time())}.wav"
-        filename = os.path.join(os.path.abspath(os.curdir), "personal", filename)
-        wave_file = wave.open(filename, 'wb')
-        wave_file.setnchannels(self.channels)
-        wave_file.setsampwidth(audio.get_sample_size(self.audio_format))
-        wave_file.setframerate(self.rate)
-        wave_file.writeframes(b''.join(self.audio_frames))
-        wave_file.close()
+        recording_thread.join()
 
         # Close the stream and PyAudio
         audio_stream.stop_stream()
         audio_stream.close()
         audio.terminate()
 
-        return filename
-        
+        samples = self.audio_frames.read_all()
+        if archive:
+            self.archive_recording(samples, self.rate)
+        return to_whisper_input(samples, self.channels, self.rate)
+
+    def record_audio_streaming(self, on_segment, end_recording_key='=', audio_device=None, archive=False):
+        # Records from an audio input device like record_audio, but runs voice activity detection on the frames as they arrive.
+        # Every time the speaker pauses, the finished speech segment is passed to on_segment(samples, rate) right away,
+        # so it can be transcribed while the user is still talking. samples is a 16 kHz mono float32 numpy array.
+        # The last segment is passed on when end_recording_key is pressed.
+        # If archive is True the whole recording is also saved as a WAV under personal/, in the background.
+        audio = pyaudio.PyAudio()
+        audio_stream = self.open_input_stream(audio, audio_device)
+        vad = EnergyVAD(self.rate, self.chunk)
+        # Every frame goes into the ring buffer, the detector only marks where segments start and end.
+        # Without archive the audio no segment can reach any more is dropped, so the buffer stays small
+        recording = AudioRingBuffer(self.rate * self.channels * (30 if archive else 5))
+        samples_per_frame = self.chunk * self.channels
+
+        def send_segment(segment):
+            if segment is not None:
+                start, end = segment
+                samples = recording.copy_range(start * samples_per_frame, end * samples_per_frame)
+                on_segment(to_whisper_input(samples, self.channels, self.rate), WHISPER_SAMPLE_RATE)
+            if not archive:
+                recording.discard_before(vad.keep_from * samples_per_frame)
+
+        def stream_frames():
+            while self.is_recording:
+                data = audio_stream.read(self.chunk, exception_on_overflow=False)
+                recording.write(data)
+                # The detector looks at a mono down-mix of the frame, which isn't kept
+                frame = np.frombuffer(data, dtype=np.int16).reshape(-1, self.channels).mean(axis=1)
+                send_segment(vad.process(frame))
+            print("[red]DONE RECORDING!")
+
+        self.is_recording = True
+        recording_thread = threading.Thread(target=stream_frames)
+        recording_thread.start()
+
+        # Wait until end key is pressed
+        while True:
+            if keyboard.is_pressed(end_recording_key):
+                break
+            time.sleep(0.05) # Add this to reduce CPU usage
+
+        self.is_recording = False
+        recording_thread.join()
+        send_segment(vad.flush())
+        if archive:
+            self.archive_recording(recording.read_all(), self.rate)
+
+        # Close the stream and PyAudio
+        audio_stream.stop_stream()
+        audio_stream.close()
+        audio.terminate()
@@ -0,0 +1,107 @@
+import io
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Callable, Iterable, Iterator, Optional
+
+from mutagen.mp3 import MP3
+
+
+class AudioStream:
+    """
+    In-memory audio clip that is filled in chunk by chunk as it arrives from the TTS stream.
+    Any number of readers (e.g. overlay HTTP requests) can iterate over it while it's still being written.
+    """
+
+    def __init__(self, stream_id: str, mimetype: str = "audio/mpeg"):
+        self.stream_id = stream_id
+        self.mimetype = mimetype
+        self.chunks = []
+        self.done = False
+        self.error: Optional[Exception] = None
+        self._condition = threading.Condition()
+
+    def feed_from(self, chunks: Iterable[bytes]):
+        """Read every chunk from a TTS iterator into the stream. Run this on a worker thread"""
+        try:
+            for chunk in chunks:
+                if chunk:
+                    with self._condition:
+                        self.chunks.append(chunk)
+                        self._condition.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._condition:
+                self.done = True
+                self._condition.notify_all()
+
+    def iter_chunks(self, idle_sleep: Optional[Callable[[float], None]] = None) -> Iterator[bytes]:
+        """
+        Yields the chunks from the start, waiting for new ones until the stream is finished
+
+        Args:
+            idle_sleep (function, optional): Waits by polling with this sleep instead of blocking on the condition.
+                Green-thread servers need this (e.g. socketio.sleep), blocking would stall every other client
+        """
+        position = 0
+        while True:
+            with self._condition:
+                if idle_sleep is None:
+                    while position >= len(self.chunks) and not self.done:
+                        self._condition.wait()
+                new_chunks = self.chunks[position:]
+                finished = self.done
+            if idle_sleep is not None and not new_chunks and not finished:
+                idle_sleep(0.01)
+                continue
+            for chunk in new_chunks:
+                yield chunk
+            position += len(new_chunks)
+            if finished and position >= len(self.chunks):
+                return
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the whole clip has arrived. Returns False on timeout"""
+        with self._condition:
+            return self._condition.wait_for(lambda: self.done, timeout)
+
+    def data(self) -> bytes:
+        """The whole clip. Only complete once the stream is done"""
+        with self._condition:
+            return b"".join(self.chunks)
+
+    def duration(self) -> float:
+        """Length of the finished clip in seconds"""
+        data = self.data()
+        if not data:
+            return 0.0
+        return MP3(io.BytesIO(data)).info.length
+
+
+class AudioStreamRegistry:
+    """Keeps the most recent audio streams in memory so the web server can serve them by id"""
+
+    def __init__(self, max_streams: int = 32):
+        """
+        Args:
+            max_streams (int, optional): Number of streams to keep. The oldest finished streams are dropped first
+        """
+        self.max_streams = max_streams
+        self.streams = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, mimetype: str = "audio/mpeg") -> AudioStream:
+        stream = AudioStream(uuid.uuid4().hex, mimetype)
+        with self._lock:
+            self.streams[stream.stream_id] = stream
+            for stream_id in list(self.streams):
+                if len(self.streams) <= self.max_streams:
+                    break
+                if self.streams[stream_id].done:
+                    del self.streams[stream_id]
+        return stream
+
+    def get(self, stream_id: str) -> Optional[AudioStream]:
+        with self._lock:
+            return self.streams.get(stream_id)
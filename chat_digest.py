@@ -0,0 +1,149 @@
+import re
+from typing import Callable, Dict, Iterable, List
+
+from token_budget import estimate_tokens
+
+# A line as TwitchChatViewer logs it: "[2024-01-01 12:00:00] #channel - username: message" (older logs have no channel)
+LOG_LINE = re.compile(r"^\[[^\]]*\]\s*(?:#\S+\s+-\s+)?([^:]+):\s?(.*)$")
+# Three or more of the same letter ("noooooo") are cut down to two. Digits and punctuation are left alone, "1000000 bits" is content
+REPEATED_CHARACTERS = re.compile(r"([^\W\d_])\1{2,}")
+# Emoji as emoji.demojize writes them, e.g. ":face_with_tears_of_joy:"
+DEMOJIZED_EMOJI = re.compile(r"^:[\w&'.-]+:$")
+# The counts collapse_repeats adds
+REPEAT_COUNT = re.compile(r" x\d+\b")
+# Common Twitch, BTTV and 7TV emotes. The chat log only has the message text, so emotes are recognized by name (they're case sensitive)
+COMMON_EMOTES = frozenset((
+    "Kappa", "KappaPride", "Keepo", "PogChamp", "Pog", "POGGERS", "PogU", "KEKW", "LUL", "LULW", "OMEGALUL", "4Head", "BibleThump",
+    "Kreygasm", "ResidentSleeper", "NotLikeThis", "FailFish", "SeemsGood", "VoHiYo", "CoolStoryBob", "DansGame", "SwiftRage",
+    "TriHard", "WutFace", "BabyRage", "HeyGuys", "MrDestructoid", "CoolCat", "Jebaited", "monkaS", "monkaW", "PepeHands",
+    "PepeLaugh", "Pepega", "Sadge", "Copium", "Clap", "EZ", "catJAM", "widepeepoHappy", "peepoHappy", "FeelsBadMan",
+    "FeelsGoodMan", "FeelsStrongMan", "WeirdChamp", "5Head", "HYPERS", "Kappa123", "PJSalt", "TwitchUnity", "GivePLZ", "TakeNRG",
+))
+QUESTION_WORDS = ("who", "what", "when", "where", "why", "how", "which", "should", "can", "could", "would", "is", "are", "do", "does", "did")
+
+
+def collapse_repeats(text: str) -> str:
+    """Shortens spam inside one message: repeated characters, and runs of the same word or emote ("KEKW KEKW KEKW" -> "KEKW x3")"""
+    text = REPEATED_CHARACTERS.sub(r"\1\1", text)
+    words = []
+    for word in text.split():
+        if words and words[-1][0] == word:
+            words[-1][1] += 1
+        else:
+            words.append([word, 1])
+    return " ".join(word if count == 1 else f"{word} x{count}" for word, count in words)
+
+
+def is_emote_only(text: str, emote_words: Iterable[str] = COMMON_EMOTES) -> bool:
+    words = REPEAT_COUNT.sub("", text).split()
+    return bool(words) and all(word in emote_words or DEMOJIZED_EMOJI.match(word) for word in words)
+
+
+def is_question(text: str) -> bool:
+    lowered = text.lower()
+    return "?" in text or lowered.split(" ", 1)[0] in QUESTION_WORDS
+
+
+class ChatDigester:
+    """
+    Turns a batch of raw chat log lines into a short digest for the LLM to summarize.
+
+    Duplicate messages are merged (and counted by how many chatters sent them), spam is collapsed, and the
+    messages are ranked so questions, @mentions and things several chatters agree on come first.
+    Only the best messages that fit in max_tokens are kept, and they're listed in the order they were sent.
+    """
+
+    def __init__(self, max_tokens: int = 1500, top_k: int = 40, count_tokens: Callable[[str], int] = estimate_tokens, mention_names: Iterable[str] = (),
+                 emote_words: Iterable[str] = ()):
+        """
+        Args:
+            max_tokens (int, optional): Token budget for the whole digest
+            top_k (int, optional): Most messages kept in a digest
+            count_tokens (function, optional): Counts the tokens of a piece of text
+            mention_names (list, optional): Names (e.g. the agents') that count as extra important when chat @mentions them
+            emote_words (list, optional): The channel's own emotes, recognized on top of COMMON_EMOTES
+        """
+        self.max_tokens = max_tokens
+        self.top_k = top_k
+        self.count_tokens = count_tokens
+        self.mention_names = {name.strip().lower() for name in mention_names}
+        self.emote_words = COMMON_EMOTES | set(emote_words)
+
+    def score(self, entry: dict) -> float:
+        text = entry["text"]
+        score = 1.0
+        if is_question(text):
+            score += 3
+        mentions = re.findall(r"@(\w+)", text)
+        if mentions:
+            score += 2
+            if any(mention.lower() in self.mention_names for mention in mentions):
+                score += 2
+        # Several chatters saying the same thing is a good sign it matters to chat
+        score += 1.5 * (len(entry["chatters"]) - 1)
+        if entry["emote_only"]:
+            score -= 2
+        if len(text.split()) < 2:
+            score -= 0.5
+        return score
+
+    def digest(self, lines: List[str]) -> str:
+        """
+        Args:
+            lines (list): Chat log lines, oldest first
+
+        Returns:
+            str: The digest, or an empty string if there was no chat in the lines
+        """
+        entries: Dict[str, dict] = {}
+        message_count = 0
+        chatters = set()
+        for line in lines:
+            match = LOG_LINE.match(line)
+            if not match:
+                continue
+            username, text = match.group(1).strip(), collapse_repeats(match.group(2).strip())
+            if not text:
+                continue
+            message_count += 1
+            chatters.add(username)
+            # "KEKW x4" and "KEKW x2" are the same message
+            key = REPEAT_COUNT.sub("", text.lower())
+            entry = entries.get(key)
+            if entry is None:
+                entry = entries[key] = {"order": len(entries), "username": username, "text": text, "count": 0, "chatters": set(), "emote_only": is_emote_only(text, self.emote_words)}
+            entry["count"] += 1
+            entry["chatters"].add(username)
+
+        if not entries:
+            return ""
+
+        header = f"Chat digest: {message_count} messages from {len(chatters)} chatters, {message_count - len(entries)} duplicates merged."
+        budget = self.max_tokens - self.count_tokens(header)
+        kept = []
+        for entry in sorted(entries.values(), key=lambda entry: (-self.score(entry), entry["order"])):
+            if len(kept) >= self.top_k:
+                break
+            entry["line"] = self.format_entry(entry)
+            line_tokens = self.count_tokens(entry["line"])
+            if line_tokens > budget:
+                continue
+            kept.append(entry)
+            budget -= line_tokens
+
+        questions = [entry["line"] for entry in sorted(kept, key=lambda entry: entry["order"]) if is_question(entry["text"])]
+        others = [entry["line"] for entry in sorted(kept, key=lambda entry: entry["order"]) if not is_question(entry["text"])]
+        sections = [header]
+        if questions:
+            sections.append("Questions:\n" + "\n".join(questions))
+        if others:
+            sections.append("Chat:\n" + "\n".join(others))
+        return "\n".join(sections)
+
+    def format_entry(self, entry: dict) -> str:
+        line = f"- {entry['username']}: {entry['text']}"
+        if len(entry["chatters"]) > 1:
+            line += f" ({len(entry['chatters'])} chatters)"
+        elif entry["count"] > 1:
+            line += f" (x{entry['count']})"
+        return line
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import threading
+from typing import List, Optional
+
+from atomic_file import write_atomic
+
+
+class ChatJournal:
+    """
+    Append-only backup for a chat history.
+
+    The history is stored in two files:
+        - the snapshot (the backup file itself), a JSON list in the same format the old full-rewrite backups used
+        - the journal (backup file + ".journal"), one JSON line per message appended since the snapshot was written
+
+    Saving only appends the new messages to the journal, so the cost of a save no longer grows with the length
+    of the history. Every compact_every messages (or whenever the history was changed in any way other than
+    appending, e.g. old messages were trimmed) the journal is folded back into a fresh snapshot.
+
+    The snapshot is always replaced atomically. The first line of the journal records which snapshot it belongs to,
+    so a crash at any point leaves either the old or the new state on disk, and a half-written last journal line is ignored.
+    """
+
+    def __init__(self, path: str, compact_every: int = 200):
+        """
+        Args:
+            path (str): Path of the snapshot file, e.g. "backup_history_ELDRIN.txt"
+            compact_every (int, optional): Number of journaled messages after which the journal is compacted
+        """
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._file = None
+        # False until a snapshot and journal header for this history have been written
+        self._started = False
+        self._journal_lines = 0
+        # What is already on disk: the number of messages and the last message object we saved
+        self._saved_count = 0
+        self._last_saved = None
+
+    @staticmethod
+    def _fingerprint(messages: list) -> str:
+        last = json.dumps(messages[-1], sort_keys=True) if messages else ""
+        return f"{len(messages)}:{hashlib.sha1(last.encode('utf-8')).hexdigest()}"
+
+    def load(self) -> Optional[List[dict]]:
+        """
+        Load the history from the snapshot plus journal.
+
+        Returns:
+            list: The chat history, or None if there is no backup yet
+        """
+        with self._lock:
+            if not os.path.exists(self.path) and not os.path.exists(self.journal_path):
+                return None
+
+            messages = []
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as file:
+                    messages = json.load(file)
+
+            journaled = []
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path, 'r', encoding='utf-8') as file:
+                    lines = file.read().split("\n")
+                try:
+                    header = json.loads(lines[0])
+                except ValueError:
+                    header = {}
+                # A journal that belongs to an older snapshot was already compacted into the current one
+                if header.get("snapshot") == self._fingerprint(messages):
+                    for line in lines[1:]:
+                        try:
+                            journaled.append(json.loads(line))
+                        except ValueError:
+                            # Empty or half-written last line from a crash
+                            break
+
+            messages.extend(journaled)
+            self._write_snapshot(messages)
+            return messages
+
+    def sync(self, messages: List[dict]):
+        """
+        Bring the backup up to date with the given history.
+        New messages at the end are appended to the journal. Any other change triggers a compaction.
+        """
+        with self._lock:
+            if not self._started:
+                self._write_snapshot(messages)
+                return
+
+            count = self._saved_count
+            appended_only = count <= len(messages) and (count == 0 or messages[count - 1] is self._last_saved)
+            if not appended_only:
+                self._write_snapshot(messages)
+                return
+
+            new_messages = messages[count:]
+            if not new_messages:
+                return
+            if self._journal_lines + len(new_messages) >= self.compact_every:
+                self._write_snapshot(messages)
+                return
+
+            if self._file is None:
+                self._file = open(self.journal_path, 'a', encoding='utf-8')
+            self._file.write("".join(json.dumps(message) + "\n" for message in new_messages))
+            self._file.flush()
+            self._journal_lines += len(new_messages)
+            self._saved_count = len(messages)
+            self._last_saved = messages[-1]
+
+    def compact(self, messages: List[dict]):
+        """Write the whole history into a new snapshot and start an empty journal"""
+        with self._lock:
+            self._write_snapshot(messages)
+
+    def _write_snapshot(self, messages: List[dict]):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        write_atomic(self.path, json.dumps(messages), durable=True)
+        # Starting the new journal is also atomic, so the journal on disk always matches one of the snapshots
+        write_atomic(self.journal_path, json.dumps({"snapshot": self._fingerprint(messages)}) + "\n", durable=True)
+
+        self._started = True
+        self._journal_lines = 0
+        self._saved_count = len(messages)
+        self._last_saved = messages[-1] if messages else None
@@ -0,0 +1,57 @@
+import threading
+from typing import Dict, List, Optional
+
+from chat_journal import ChatJournal
+
+
+class ConversationLog:
+    """
+    The one shared, append-only transcript of the conversation.
+
+    Every utterance (agents, the human, chat summaries) is stored here exactly once, instead of being copied into
+    every agent's chat history. Each entry is already in chat message format from a listener's point of view:
+        {"role": "user", "speaker": "ELDRIN", "text": "...", "content": "[ELDRIN] ..."}
+    so agents can put other speakers' entries straight into their requests without copying them.
+
+    Entries are never changed or removed, so the number of entries doubles as a version number of the transcript.
+    """
+
+    def __init__(self, backup_file: Optional[str] = None):
+        """
+        Args:
+            backup_file (str, optional): Path to backup file for the transcript
+        """
+        self.entries: List[Dict[str, str]] = []
+        self._lock = threading.Lock()
+        self.journal = ChatJournal(backup_file) if backup_file else None
+
+        # Load the transcript from backup if it exists
+        backup_entries = self.journal.load() if self.journal else None
+        if backup_entries is not None:
+            self.entries = backup_entries
+
+    def append(self, speaker: str, text: str) -> int:
+        """
+        Add an utterance to the transcript and back it up.
+
+        Args:
+            speaker (str): Name of whoever said it
+            text (str): What they said
+
+        Returns:
+            int: The index of the new entry
+        """
+        entry = {
+            "role": "user",
+            "speaker": speaker,
+            "text": text,
+            "content": f"[{speaker}] {text}"
+        }
+        with self._lock:
+            self.entries.append(entry)
+            if self.journal:
+                self.journal.sync(self.entries)
+            return len(self.entries) - 1
+
+    def __len__(self):
+        return len(self.entries)
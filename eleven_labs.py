@@ -1,34 +1,145 @@
 from elevenlabs.client import ElevenLabs
-from elevenlabs import play, stream, save, Voice, VoiceSettings
-import time
+from elevenlabs import play, stream, Voice, VoiceSettings
 import os
+import base64
+import threading
+from typing import Iterator
+
+from tts_cache import TTSCache
+from voice_catalog import VoiceCatalog
 
 class ElevenLabsManager:
 
-    def __init__(self):
-        self.client = ElevenLabs(api_key=os.getenv('ELEVENLABS_API_KEY')) # Defaults to ELEVEN_API_KEY)
-        self.voices = self.client.voices.get_all().voices
+    # base_url (or ELEVENLABS_BASE_URL) points the client at a different API server, e.g. a local stand-in for offline testing
+    def __init__(self, tts_cache=None, voice_catalog=None, base_url=None):
+        base_url = base_url or os.getenv('ELEVENLABS_BASE_URL')
+        client_options = {"api_key": os.getenv('ELEVENLABS_API_KEY')} # Defaults to ELEVEN_API_KEY
+        if base_url:
+            client_options["base_url"] = base_url
+        self.client = ElevenLabs(**client_options)
+        # The voice list and voice settings are kept on disk, so startup doesn't have to wait for the API.
+        # A stale catalog is still used right away and gets refreshed in the background
+        self.voice_catalog = voice_catalog if voice_catalog is not None else VoiceCatalog()
         # Create a map of Names->IDs, so that we can easily grab a voice's ID later on 
-        self.voice_to_id = {}
-        for voice in self.voices:
-           self.voice_to_id[voice.name] = voice.voice_id
+        self.voice_to_id = dict(self.voice_catalog.voice_to_id)
         self.voice_to_settings = {}
+        if self.voice_catalog.is_empty():
+            self.refresh_voices()
+        elif self.voice_catalog.is_stale():
+            refresh_thread = threading.Thread(target=self.refresh_voices)
+            refresh_thread.daemon = True
+            refresh_thread.start()
+        # Generated clips are cached on disk, so repeated lines (catchphrases!) don't hit the API again
+        self.tts_cache = tts_cache if tts_cache is not None else TTSCache()
+
+    # Fetch the voice list and the settings of every voice we already know about from the API, and update the catalog.
+    # With an empty catalog this has to succeed, otherwise errors are only printed and the stale catalog stays in use
+    def refresh_voices(self):
+        try:
+            voices = self.client.voices.get_all().voices
+            self.voice_to_id = {voice.name: voice.voice_id for voice in voices}
+            self.voice_catalog.set_voices(self.voice_to_id)
+            for voice_id in list(self.voice_catalog.settings):
+                self.voice_catalog.set_settings(voice_id, self.settings_to_dict(self.client.voices.get_settings(voice_id)))
+            # Settings are looked up from the refreshed catalog again the next time they're needed
+            self.voice_to_settings = {}
+        except Exception as e:
+            if self.voice_catalog.is_empty():
+                raise
+            print(f"Couldn't refresh the Elevenlabs voice catalog, using the cached one: {str(e)}")
+
+    # A voice that isn't in the catalog might have been created since it was last refreshed, so that's tried once before giving up
+    def get_voice_id(self, voice):
+        if voice not in self.voice_to_id:
+            self.refresh_voices()
+            if voice not in self.voice_to_id:
+                raise ValueError(f"Elevenlabs has no voice named '{voice}'. The available voices are: {', '.join(sorted(self.voice_to_id))}")
+        return self.voice_to_id[voice]
 
-    # Convert text to speech, then save it to file. Returns the file path.
+    # Load the settings of the given voices ahead of time, so an agent's first line doesn't wait on the API
+    def prefetch_voices(self, voices):
+        for voice in voices:
+            try:
+                self.get_voice_settings(voice)
+            except Exception as e:
+                print(f"Couldn't prefetch the settings for voice {voice}: {str(e)}")
+
+    # Convert text to speech, then save it into the TTS cache. Returns the file path. Lines that are already cached are returned without calling the API.
     # Current model options (that I would use) are eleven_monolingual_v1 or eleven_turbo_v2
     # eleven_turbo_v2 takes about 60% of the time that eleven_monolingual_v1 takes
     # However eleven_monolingual_v1 seems to produce more variety and emphasis, whereas turbo feels more monotone. Turbo still sounds good, just a little less interesting
     def text_to_audio(self, input_text, voice="Doug VO Only", save_as_wave=True, subdirectory="", model_id="eleven_flash_v2_5"):
         # Currently seems to be a problem with the API where it uses default voice settings, rather than pulling the proper settings from the website
         # Workaround is to get the voice settings for each voice the first time it's used, then pass those settings in manually
-        if voice not in self.voice_to_settings:
-            self.voice_to_settings[voice] = self.client.voices.get_settings(self.voice_to_id[voice])
-        voice_settings = self.voice_to_settings[voice]
-        audio_saved = self.client.generate(text=input_text, voice=Voice(voice_id=self.voice_to_id[voice], settings=voice_settings), model=model_id,)
-        if save_as_wave:
-            file_name = f"___Msg{str(hash(input_text))}{time.time()}_{model_id}.wav"
-        else:
-            file_name = f"___Msg{str(hash(input_text))}{time.time()}_{model_id}.mp3"
-        tts_file = os.path.join(os.path.abspath(os.curdir), "static", "msg", file_name)
-        save(audio_saved,tts_file)
-        return tts_file
\ No newline at end of file
+        voice_settings = self.get_voice_settings(voice)
+        cache_key = self.cache_key(input_text, voice, model_id, save_as_wave)
+        cached = self.tts_cache.get(cache_key)
+        if cached is not None:
+            return cached[0]
+        audio_saved = self.client.generate(text=input_text, voice=Voice(voice_id=self.get_voice_id(voice), settings=voice_settings), model=model_id,)
+        if isinstance(audio_saved, Iterator):
+            audio_saved = b"".join(audio_saved)
+        return self.tts_cache.put(cache_key, audio_saved, self.file_extension(save_as_wave))
+
+    # Same as text_to_audio, but also asks Elevenlabs for the character alignment of the audio.
+    # Returns the file path and the alignment dictionary ('characters', 'character_start_times_seconds', 'character_end_times_seconds').
+    # The alignment is what lets us build subtitle timestamps without running Whisper on our own audio.
+    # If the timestamps endpoint isn't available the alignment is None, and callers should fall back to the audio duration.
+    def text_to_audio_with_timestamps(self, input_text, voice="Doug VO Only", save_as_wave=True, subdirectory="", model_id="eleven_flash_v2_5"):
+        voice_settings = self.get_voice_settings(voice)
+        cache_key = self.cache_key(input_text, voice, model_id, save_as_wave)
+        cached = self.tts_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        try:
+            response = self.client.text_to_speech.convert_with_timestamps(voice_id=self.get_voice_id(voice), text=input_text, model_id=model_id, voice_settings=voice_settings)
+        except AttributeError:
+            return self.text_to_audio(input_text, voice, save_as_wave, subdirectory, model_id), None
+        alignment = response.get("alignment")
+        tts_file = self.tts_cache.put(cache_key, base64.b64decode(response["audio_base64"]), self.file_extension(save_as_wave), alignment)
+        return tts_file, alignment
+
+    # Convert text to speech as a stream. Returns an iterator over the audio (mp3) chunks as Elevenlabs generates them,
+    # so playback can start before synthesis has finished.
+    # If persist is True the finished clip is also stored in the TTS cache (which is size capped), and cached lines are returned in one chunk.
+    def text_to_audio_stream(self, input_text, voice="Doug VO Only", model_id="eleven_flash_v2_5", persist=True):
+        voice_settings = self.get_voice_settings(voice)
+        cache_key = self.cache_key(input_text, voice, model_id, False)
+        if persist:
+            cached = self.tts_cache.get(cache_key)
+            if cached is not None:
+                with open(cached[0], "rb") as f:
+                    yield f.read()
+                return
+        audio_stream = self.client.generate(text=input_text, voice=Voice(voice_id=self.get_voice_id(voice), settings=voice_settings), model=model_id, stream=True)
+        chunks = []
+        for chunk in audio_stream:
+            chunks.append(chunk)
+            yield chunk
+        if persist:
+            self.tts_cache.put(cache_key, b"".join(chunks), self.file_extension(False))
+
+    def get_voice_settings(self, voice):
+        # Read through a local, a background refresh can clear voice_to_settings at any point
+        voice_settings = self.voice_to_settings.get(voice)
+        if voice_settings is None:
+            voice_id = self.get_voice_id(voice)
+            cached_settings = self.voice_catalog.get_settings(voice_id)
+            if cached_settings is not None:
+                voice_settings = VoiceSettings(**cached_settings)
+            else:
+                voice_settings = self.client.voices.get_settings(voice_id)
+                self.voice_catalog.set_settings(voice_id, self.settings_to_dict(voice_settings))
+            self.voice_to_settings[voice] = voice_settings
+        return voice_settings
+
+    def settings_to_dict(self, voice_settings):
+        return voice_settings.dict() if hasattr(voice_settings, "dict") else dict(voice_settings)
+
+    # Stable cache key for a line: the same text, voice, model and voice settings always give the same audio
+    def cache_key(self, input_text, voice, model_id, save_as_wave):
+        voice_settings = self.get_voice_settings(voice)
+        return self.tts_cache.make_key(input_text, self.get_voice_id(voice), model_id, self.settings_to_dict(voice_settings), self.file_extension(save_as_wave))
+
+    def file_extension(self, save_as_wave):
+        return ".wav" if save_as_wave else ".mp3"
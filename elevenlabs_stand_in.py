@@ -0,0 +1,137 @@
+import base64
+import json
+import re
+import sys
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+from rich import print
+
+# Seconds of "speech" per character in the fake alignment data
+SECONDS_PER_CHARACTER = 0.05
+DEFAULT_SETTINGS = {"stability": 0.5, "similarity_boost": 0.75, "style": 0.0, "use_speaker_boost": True}
+
+
+class ElevenLabsStandIn:
+    """
+    Local stand-in for the parts of the Elevenlabs API the app uses: the voice list, voice settings and text to speech
+    (plain, streamed and with timestamps). The "audio" is just the text as bytes, behind an ID3 header.
+
+    Point ElevenLabsManager at it with base_url (or ELEVENLABS_BASE_URL) to run everything offline, e.g. in tests.
+    Every request is recorded in requests as (method, path), so tests can check what actually reached the API.
+    """
+
+    def __init__(self, voices: Optional[Dict[str, dict]] = None, host: str = "127.0.0.1", port: int = 0):
+        """
+        Args:
+            voices (dict, optional): Voice name -> settings. Defaults to one voice per agent of the app
+            host (str, optional): Address to listen on
+            port (int, optional): Port to listen on. 0 picks a free one
+        """
+        self.voices: Dict[str, dict] = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        for name, settings in (voices if voices is not None else {"Eldrin ": None, "Doug VO Only": None}).items():
+            self.add_voice(name, settings)
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def add_voice(self, name: str, settings: Optional[dict] = None, voice_id: Optional[str] = None) -> str:
+        """Add a voice (or replace its settings). Returns its voice id"""
+        with self._lock:
+            existing = self.voices.get(name)
+            voice_id = voice_id or (existing["voice_id"] if existing else uuid.uuid4().hex[:20])
+            self.voices[name] = {"voice_id": voice_id, "settings": dict(settings or DEFAULT_SETTINGS)}
+        return voice_id
+
+    def start(self) -> "ElevenLabsStandIn":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _voice_by_id(self, voice_id: str) -> Optional[dict]:
+        with self._lock:
+            for voice in self.voices.values():
+                if voice["voice_id"] == voice_id:
+                    return voice
+        return None
+
+    def _handler_class(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                stand_in.requests.append(("GET", path))
+                if path == "/v1/voices":
+                    with stand_in._lock:
+                        voices = [{"voice_id": voice["voice_id"], "name": name} for name, voice in stand_in.voices.items()]
+                    return self._send_json({"voices": voices})
+                match = re.fullmatch(r"/v1/voices/([^/]+)/settings", path)
+                voice = stand_in._voice_by_id(match.group(1)) if match else None
+                if voice is None:
+                    return self._send_json({"detail": "Not found"}, 404)
+                self._send_json(voice["settings"])
+
+            def do_POST(self):
+                path = self.path.split("?", 1)[0]
+                stand_in.requests.append(("POST", path))
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                match = re.fullmatch(r"/v1/text-to-speech/([^/]+)(/stream)?(/with-timestamps)?", path)
+                if match is None or stand_in._voice_by_id(match.group(1)) is None:
+                    return self._send_json({"detail": "Not found"}, 404)
+                text = body.get("text", "")
+                audio = b"ID3" + text.encode("utf-8")
+                if match.group(3):
+                    return self._send_json({
+                        "audio_base64": base64.b64encode(audio).decode("ascii"),
+                        "alignment": {
+                            "characters": list(text),
+                            "character_start_times_seconds": [round(i * SECONDS_PER_CHARACTER, 3) for i in range(len(text))],
+                            "character_end_times_seconds": [round((i + 1) * SECONDS_PER_CHARACTER, 3) for i in range(len(text))],
+                        },
+                    })
+                self.send_response(200)
+                self.send_header("Content-Type", "audio/mpeg")
+                self.send_header("Content-Length", str(len(audio)))
+                self.end_headers()
+                self.wfile.write(audio)
+
+            def _send_json(self, data, status=200):
+                payload = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    # python elevenlabs_stand_in.py [port], then run the app with ELEVENLABS_BASE_URL=http://127.0.0.1:<port>
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    stand_in = ElevenLabsStandIn(port=port)
+    print(f"[green]Elevenlabs stand-in running on {stand_in.base_url}")
+    stand_in.server.serve_forever()
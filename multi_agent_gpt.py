@@ -1,6 +1,7 @@
-from flask import Flask, render_template, session, request
-from flask_socketio import SocketIO, emit
+from flask import Flask, render_template, session, request, Response, abort, jsonify
+from flask_socketio import SocketIO, emit, join_room
 import threading
+import queue
 import time
 import keyboard
 import random
@@ -8,6 +9,7 @@ import logging
 import sys
 import os
 import signal
+import uuid
 from rich import print
 import atexit
 
@@ -15,7 +17,14 @@ from audio_player import AudioManager
 from eleven_labs import ElevenLabsManager
 # from openai_chat import OpenAiManager
 from ollama_chat import OllamaManager
-from whisper_openai import WhisperManager
+from conversation_log import ConversationLog
+from whisper_openai import WhisperManager, StreamingTranscriber
+from subtitle_timing import sentence_timestamps
+from audio_stream import AudioStream, AudioStreamRegistry
+from twitch_log_reader import TwitchLogReader, find_current_log
+from chat_digest import ChatDigester
+from turn_pipeline import TurnPipeline, Turn
+from overlay_events import OverlayEmitter, resolve_async_mode, socket_transports, agent_room
 # from obs_websockets import OBSWebsocketsManager
 from ai_prompts import *
 
@@ -26,112 +35,381 @@ flask_shutdown_flag = threading.Event()
 socketio = SocketIO
 app = Flask(__name__, host_matching=False)
 app.config['SERVER_NAME'] = "127.0.0.1:5151"
-socketio = SocketIO(app, async_mode="threading")
+# SOCKETIO_ASYNC_MODE=eventlet (or gevent) serves the overlays from green threads over WebSocket only, instead of a thread per client
+SOCKETIO_ASYNC_MODE = resolve_async_mode(os.getenv("SOCKETIO_ASYNC_MODE", "threading"))
+SOCKETIO_TRANSPORTS = socket_transports(SOCKETIO_ASYNC_MODE)
+socketio = SocketIO(app, async_mode=SOCKETIO_ASYNC_MODE, transports=SOCKETIO_TRANSPORTS)
+# Every overlay event goes through here, to the room of the agent it's about
+overlay = OverlayEmitter(socketio, SOCKETIO_ASYNC_MODE)
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
 
 # Store thread references globally
 all_threads = []
+all_agents = []
 
 @app.route("/")
 def home():
-    return render_template('index.html')
+    return render_template('index.html', socket_transports=SOCKETIO_TRANSPORTS)
 
 @app.route("/agent")
 def agent():
-    return render_template('agent.html')
+    return render_template('agent.html', socket_transports=SOCKETIO_TRANSPORTS)
+
+@app.route("/bench/subtitles")
+def bench_subtitles():
+    # Measures frame times while the subtitle renderer shows 1000 sentences (?renderer=legacy for the old Letterize + anime.js version)
+    return render_template('bench_subtitles.html')
+
+# Agent audio that is still being synthesized is kept in memory and streamed to the overlay from here
+audio_streams = AudioStreamRegistry()
+
+@app.route("/audio/<stream_id>")
+def audio_stream(stream_id):
+    # Sends the audio as it arrives from the TTS stream (chunked), so the overlay can start playing before synthesis finishes
+    stream = audio_streams.get(stream_id)
+    if stream is None:
+        abort(404)
+    # Green-thread servers must not block on the stream, so they poll it instead
+    idle_sleep = None if SOCKETIO_ASYNC_MODE == "threading" else socketio.sleep
+    return Response(stream.iter_chunks(idle_sleep), mimetype=stream.mimetype)
+
+@app.route("/pipeline/stats")
+def pipeline_stats():
+    # Queue depth, busy workers and backpressure of every stage of the turn pipeline
+    return jsonify(turn_pipeline.stats())
 
 @socketio.event
 def connect():
     print("[green]The server connected to client!")
 
-whisper_manager = WhisperManager()
+@socketio.on('join_agent')
+def join_agent(msg):
+    # An agent.html overlay joins its own agent's room and only gets that agent's events. Without an agent_id (e.g. the
+    # main page) the overlay joins every agent's room
+    agent_id = (msg or {}).get('agent_id')
+    agent_ids = [agent_id] if agent_id is not None else [agent.agent_id for agent in all_agents]
+    for agent_id in agent_ids:
+        join_room(agent_room(agent_id))
+
+# Turns the overlay is playing right now, by turn id. The overlay that plays the audio (agent.html) sends agent_done once it has ended
+pending_playback = {}
+pending_playback_lock = threading.Lock()
+# How long to wait past the end of the audio for the overlay's agent_done, before giving up on it (e.g. no overlay is open)
+PLAYBACK_ACK_SLACK = 1.0
+# How long a TTS stream may take to fully arrive before it counts as stalled: a base wait plus some time per character of text
+STREAM_TIMEOUT_BASE = 10.0
+STREAM_TIMEOUT_PER_CHARACTER = 0.1
+
+@socketio.on('agent_done')
+def agent_done(msg):
+    with pending_playback_lock:
+        done = pending_playback.get(msg.get('turn_id'))
+    if done is not None:
+        done.set()
+
+def play_on_overlay(agent_id, audio, schedule, duration=None, stream=None, stream_timeout=None):
+    # Sends the audio and its subtitle schedule to the overlay in one go. The overlay times the subtitles against the audio itself,
+    # so all we do here is wait until it tells us playback has ended (or until the audio must have ended, if nobody answers).
+    # For a stream the clip's length is only known once it has fully arrived. A stream that hasn't arrived within stream_timeout
+    # is given up on like a failed one, so a stalled TTS request can't hold the speaking slot. Returns True if the overlay acknowledged
+    turn_id = uuid.uuid4().hex
+    done = threading.Event()
+    with pending_playback_lock:
+        pending_playback[turn_id] = done
+    try:
+        start_time = time.time()
+        overlay.emit('agent_turn', {'agent_id': agent_id, 'turn_id': turn_id, 'audio': audio, 'schedule': schedule}, agent_id)
+        if stream is not None:
+            if not stream.wait(stream_timeout):
+                print(f"[magenta] TTS stream stalled, gave up on it after {stream_timeout:.0f} seconds")
+                return False
+            if stream.error:
+                print(f"[magenta] Error synthesizing sentence: {str(stream.error)}")
+                return False
+            duration = stream.duration()
+        return done.wait(max(0, duration + PLAYBACK_ACK_SLACK - (time.time() - start_time)))
+    finally:
+        with pending_playback_lock:
+            pending_playback.pop(turn_id, None)
+
+# Whisper is loaded in the background the first time it's needed. Pick a smaller model or int8 for CPU-only machines,
+# e.g. WHISPER_MODEL=small WHISPER_DTYPE=int8
+whisper_manager = WhisperManager(model_size=os.getenv("WHISPER_MODEL", "large-v3"), dtype=os.getenv("WHISPER_DTYPE", "auto"))
 elevenlabs_manager = ElevenLabsManager()
 audio_manager = AudioManager()
 
 speaking_lock = threading.Lock()
 conversation_lock = threading.Lock()
 
+# Everything said in the conversation is stored once here and shared by all agents
+conversation_log = ConversationLog("backup_conversation.txt")
+
+# Remembers how far into the twitch logs we've read, so each chat summary only sends new chat.
+# The raw chat is boiled down to a digest (duplicates merged, spam collapsed, best messages kept) before it goes to the LLM,
+# so the reader can take in a lot more chat than ends up in the prompt
+chat_digester = ChatDigester(max_tokens=int(os.getenv("TWITCH_SUMMARY_TOKENS", "1500")))
+twitch_log_reader = TwitchLogReader(max_tokens=10 * chat_digester.max_tokens)
+
 agents_paused = False
 
+def site_path(file_path):
+    # Turns the path of a file under static/ into the URL path the overlay fetches it from
+    return os.path.relpath(file_path, os.path.abspath(os.curdir)).replace(os.path.sep, "/")
+
+# Callbacks for the turn pipeline, which runs pipelined agent turns as LLM -> TTS -> align -> playback stages
+def synthesize_sentence(item, forward):
+    agent = item.turn.agent
+    if agent.stream_audio:
+        # Playback can start as soon as the stream does. The TTS slot stays busy until the whole clip has arrived
+        stream = audio_streams.create()
+        item.audio = stream
+        forward()
+        stream.feed_from(elevenlabs_manager.text_to_audio_stream(item.text, agent.voice))
+    else:
+        item.audio = elevenlabs_manager.text_to_audio(item.text, agent.voice, False)
+
+def align_sentence(item):
+    # Finished files can be measured before playback, streams are measured once they've fully arrived
+    if not isinstance(item.audio, AudioStream):
+        item.duration = audio_manager.get_audio_length(item.audio)
+
+def start_agent_turn(turn):
+    # Held until end_agent_turn, so non-pipelined agents can't talk over a pipelined turn
+    speaking_lock.acquire()
+    overlay.emit('start_agent', {'agent_id': turn.agent.agent_id}, turn.agent.agent_id)
+
+def play_sentence(item):
+    if shutdown_flag.is_set():
+        return
+    agent_id = item.turn.agent.agent_id
+    # Each sentence of a pipelined turn is its own clip, so its schedule is just the one sentence for the whole clip
+    schedule = [{'text': item.text, 'start_time': 0, 'end_time': item.duration}]
+    if isinstance(item.audio, AudioStream):
+        # The overlay starts playing the stream straight away
+        stream_timeout = STREAM_TIMEOUT_BASE + STREAM_TIMEOUT_PER_CHARACTER * len(item.text)
+        play_on_overlay(agent_id, f"audio/{item.audio.stream_id}", schedule, stream=item.audio, stream_timeout=stream_timeout)
+        return
+    with elevenlabs_manager.tts_cache.pinned(item.audio):
+        play_on_overlay(agent_id, site_path(item.audio), schedule, duration=item.duration)
+
+def end_agent_turn(turn):
+    try:
+        overlay.emit('clear_agent', {'agent_id': turn.agent.agent_id}, turn.agent.agent_id)
+        time.sleep(1)
+    finally:
+        speaking_lock.release()
+
+# One LLM slot, several TTS slots, and one slot each for alignment and playback
+turn_pipeline = TurnPipeline(synthesize_sentence, align_sentence, play_sentence, start_agent_turn, end_agent_turn,
+                             tts_workers=int(os.getenv("TTS_WORKERS", "3")))
+
 class Agent():
-    def __init__(self, agent_name, agent_id, filter_name, all_agents, system_prompt, elevenlabs_voice):
-        self.activated = False
+    RESPONSE_PROMPT = "Okay what is your response? Try to be as chaotic and bizarre and adult-humor oriented as possible. Again, 3 sentences maximum."
+
+    def __init__(self, agent_name, agent_id, filter_name, all_agents, system_prompt, elevenlabs_voice, pipelined=True, stream_audio=True, speculate=True):
+        # Activations are queued, so an activation that arrives while the agent is busy is handled right after the current turn
+        self.activations = queue.Queue()
+        self.cancelled = threading.Event()
+        # Pipelined turns send every sentence to TTS on its own as soon as it's generated,
+        # and play sentence N while sentence N+1 is still being synthesized
+        self.pipelined = pipelined
+        # In pipelined turns, stream each sentence's audio to the overlay over HTTP while it's being synthesized
+        self.stream_audio = stream_audio
+        # While another agent is speaking, draft our next reply (text and audio) in case we're up next.
+        # The draft is only used if the conversation hasn't changed since, otherwise it's thrown away
+        self.speculate = speculate
+        self.draft = None
+        self.taking_turn = False
         self.name = agent_name
         self.agent_id = agent_id
         self.filter_name = filter_name
         self.all_agents = all_agents
         self.voice = elevenlabs_voice
-        self.break_loop = False
         backup_file_name = f"backup_history_{agent_name}.txt"
-        self.ollama_manager = OllamaManager(system_prompt, backup_file_name)
+        self.ollama_manager = OllamaManager(system_prompt, backup_file_name, shared_log=conversation_log, speaker_name=agent_name)
         self.ollama_manager.logging = False
 
     def run(self):
         while not shutdown_flag.is_set():
-            if self.break_loop:
+            # Sleep until someone activates (or cancels) this agent
+            self.activations.get()
+            if self.cancelled.is_set():
                 print(f"[italic red] {self.name} has been TERMINATED")
                 break
-            if not self.activated:
-                time.sleep(0.1)
-                continue
             
             try:
                 print(f"[italic purple] {self.name} has been ACTIVATED.")
                 
-                self.activated = False
                 print(f"[italic purple] {self.name} has STARTED speaking.")
+
+                if self.pipelined:
+                    self.take_pipelined_turn()
+                    print(f"[italic purple] {self.name} has FINISHED speaking.")
+                    continue
                 
                 with conversation_lock:
                     if shutdown_flag.is_set():
                         break
-                    openai_answer = self.ollama_manager.chat_with_history("Okay what is your response? Try to be as chaotic and bizarre and adult-humor oriented as possible. Again, 3 sentences maximum.")
-                    openai_answer = openai_answer.replace("*", "")
+                    sentences = self.generate_reply()
+                    if not sentences:
+                        print(f"[red]{self.name} did not get a response from Ollama")
+                        continue
+                    openai_answer = " ".join(sentences)
+                    print(f"[grey50]{self.name} Ollama latency: {self.ollama_manager.format_latency()}")
                     print(f'[magenta]Got the following response:\n{openai_answer}')
 
-                    for agent in self.all_agents:
-                        if agent is not self:
-                            agent.ollama_manager.chat_history.append({"role": "user", "content": f"[{self.name}] {openai_answer}"})
-                            agent.ollama_manager.save_chat_to_backup()
-
                 if shutdown_flag.is_set():
                     break
-                    
-                tts_file = elevenlabs_manager.text_to_audio(openai_answer, self.voice, False)
-                audio_and_timestamps = whisper_manager.audio_to_text(tts_file, "sentence")
+
+                # We already know the text, so subtitle timings come from the TTS alignment (or the audio length) instead of running Whisper on our own audio
+                tts_file, alignment = elevenlabs_manager.text_to_audio_with_timestamps(openai_answer, self.voice, False)
+                # The audio is only measured if the alignment is missing or unusable
+                audio_and_timestamps = sentence_timestamps(openai_answer, lambda: audio_manager.get_audio_length(tts_file), alignment)
 
                 with speaking_lock:
                     if shutdown_flag.is_set():
                         break
-                    socketio.emit('start_agent', {'agent_id': self.agent_id})
-                    tts_file_name = tts_file.split(os.path.sep)[-1]
-                    site_tts_file = f"static/msg/{tts_file_name}"
-                    socketio.emit('agent_audio', {'agent_id': self.agent_id, 'audio': site_tts_file})
-
-                    try:
-                        for i in range(len(audio_and_timestamps)):
-                            if shutdown_flag.is_set():
-                                break
-                            current_sentence = audio_and_timestamps[i]
-                            duration = current_sentence['end_time'] - current_sentence['start_time']
-                            socketio.emit('agent_message', {'agent_id': self.agent_id, 'text': f"{current_sentence['text']}"})
-                            time.sleep(duration)
-                            if i < (len(audio_and_timestamps) - 1):
-                                time_between_sentences = audio_and_timestamps[i+1]['start_time'] - current_sentence['end_time']
-                                time.sleep(time_between_sentences)
-                    except Exception as e:
-                        print(f"[magenta] Error processing sentence: {str(e)}")
+                    overlay.emit('start_agent', {'agent_id': self.agent_id}, self.agent_id)
+                    # Nothing to subtitle (e.g. the reply was only whitespace), so go by the length of the audio
+                    total_duration = audio_and_timestamps[-1]['end_time'] if audio_and_timestamps else audio_manager.get_audio_length(tts_file)
+                    with elevenlabs_manager.tts_cache.pinned(tts_file):
+                        play_on_overlay(self.agent_id, site_path(tts_file), audio_and_timestamps, duration=total_duration)
                     
-                    socketio.emit('clear_agent', {'agent_id': self.agent_id})
+                    overlay.emit('clear_agent', {'agent_id': self.agent_id}, self.agent_id)
                     time.sleep(1)
 
                 print(f"[italic purple] {self.name} has FINISHED speaking.")
+                self.hand_off(self.pick_next_agent())
             
             except Exception as e:
                 print(f"[red]Error in agent {self.name}: {str(e)}")
                 if shutdown_flag.is_set():
                     break
 
+    def generate_reply(self, commit=True, turn=None):
+        # Streams a reply from Ollama. Must be called with conversation_lock held.
+        # With a turn, every sentence goes into the turn pipeline (to be synthesized) as soon as it has been generated
+        sentences = []
+        for sentence in self.ollama_manager.chat_with_history_stream(self.RESPONSE_PROMPT, commit=commit):
+            sentence = sentence.replace("*", "").strip()
+            if not sentence:
+                continue
+            print(f'[magenta]{self.name} sentence {len(sentences)+1}: {sentence}')
+            sentences.append(sentence)
+            if turn is not None:
+                turn_pipeline.add_sentence(turn, sentence)
+        return sentences
+
+    def take_pipelined_turn(self):
+        # Runs our turn through the turn pipeline, using our draft if it's still valid, and waits until it has been played
+        self.taking_turn = True
+        try:
+            self.run_pipelined_turn()
+        finally:
+            self.taking_turn = False
+
+    def run_pipelined_turn(self):
+        turn = None
+        with conversation_lock:
+            if shutdown_flag.is_set():
+                return
+            draft = self.take_draft()
+            if draft is not None:
+                print(f"[grey50]{self.name} is using the reply it drafted while the last agent was speaking")
+                self.ollama_manager.commit_draft(self.RESPONSE_PROMPT, draft["reply"])
+                turn = draft["turn"]
+                turn_pipeline.commit(turn)
+        if turn is None:
+            turn = Turn(self)
+            # Turns play in the order they're committed, so claim our place before generating
+            turn_pipeline.commit(turn)
+            turn_pipeline.submit(self.generate_turn, turn)
+
+        turn.generated.wait()
+        if not turn.sentences:
+            print(f"[red]{self.name} did not get a response from Ollama")
+            return
+        print(f"[grey50]{self.name} Ollama latency: {self.ollama_manager.format_latency()}")
+        print(f'[magenta]Got the following response:\n{" ".join(turn.sentences)}')
+
+        # Our reply is in the transcript now, so whoever is up next can work on theirs while we speak
+        next_agent = self.pick_next_agent()
+        if next_agent is not None and next_agent.speculate:
+            next_agent.request_draft()
+        while not turn.finished.wait(timeout=0.5):
+            if shutdown_flag.is_set():
+                return
+        self.hand_off(next_agent)
+
+    def generate_turn(self, turn):
+        # Runs on the turn pipeline's LLM stage
+        with conversation_lock:
+            if shutdown_flag.is_set():
+                return
+            self.generate_reply(turn=turn)
+
+    def draft_reply(self, turn):
+        # Runs on the turn pipeline's LLM stage. Speculatively generates (and synthesizes) our next reply without adding it to the conversation.
+        # The transcript length is the conversation's version: if anything gets said before our turn, the draft is stale
+        with conversation_lock:
+            # No point drafting if our turn has already started without a draft
+            if shutdown_flag.is_set() or agents_paused or self.taking_turn:
+                turn_pipeline.cancel(turn)
+                return
+            version = len(conversation_log)
+            print(f"[grey50]{self.name} is drafting a reply while the last agent speaks")
+            self.ollama_manager.last_draft = None
+            sentences = self.generate_reply(commit=False, turn=turn)
+            if not sentences or not self.ollama_manager.last_draft:
+                turn_pipeline.cancel(turn)
+                return
+            if self.draft is not None:
+                turn_pipeline.cancel(self.draft["turn"])
+            self.draft = {"version": version, "reply": self.ollama_manager.last_draft, "turn": turn}
+
+    def take_draft(self):
+        # Returns our draft if it's still valid and forgets it either way. Must be called with conversation_lock held
+        draft = self.draft
+        self.draft = None
+        if draft is None:
+            return None
+        if draft["version"] != len(conversation_log):
+            print(f"[grey50]{self.name} threw away its drafted reply, the conversation moved on")
+            turn_pipeline.cancel(draft["turn"])
+            return None
+        return draft
+
+    def request_draft(self):
+        # Ask this agent to draft its next reply on the LLM stage. Only pipelined agents draft, since drafts go through the turn pipeline
+        if self.pipelined:
+            turn_pipeline.submit(self.draft_reply, Turn(self))
+
+    def pick_next_agent(self):
+        # The agent that speaks after us, or None if agents are paused or there's nobody else
+        if agents_paused:
+            return None
+        other_agents = [agent for agent in self.all_agents if agent is not self]
+        if not other_agents:
+            return None
+        return random.choice(other_agents)
+
+    def hand_off(self, next_agent):
+        # Let the next agent take its turn, unless the agents were paused while we were speaking
+        if next_agent is None or agents_paused or shutdown_flag.is_set():
+            return
+        print(f"[cyan]Activating {next_agent.name}")
+        next_agent.activate()
+
+    def activate(self):
+        # Wakes the agent up to take a turn. Safe to call from any thread
+        self.activations.put("turn")
+
+    def cancel(self):
+        # Stops the agent's run loop, waking it up if it's idle
+        self.cancelled.set()
+        self.activations.put(None)
+
 class Human():
     def __init__(self, name, all_agents):
         self.name = name
@@ -145,6 +423,7 @@ class Human():
                     print("[italic red] Initiating shutdown...")
                     shutdown_flag.set()
                     flask_shutdown_flag.set()
+                    cancel_agents()
                     break
 
                 if keyboard.is_pressed('num 7'):
@@ -154,17 +433,27 @@ class Human():
                     print(f"[italic red] Agents have been paused")
 
                     print(f"[italic green] {self.name} has STARTED speaking.")
-                    mic_audio = audio_manager.record_audio(end_recording_key='num 8', audio_device="Voicemeeter Out B1")
+                    # Load Whisper while we're recording, if it isn't loaded yet
+                    whisper_manager.load_in_background()
+                    # Speech segments are transcribed while we're still talking, every time there's a pause
+                    transcriber = StreamingTranscriber(whisper_manager)
+                    audio_manager.record_audio_streaming(transcriber.add_segment, end_recording_key='num 8', audio_device="Voicemeeter Out B1")
+
+                    if not whisper_manager.wait_until_ready(timeout=120):
+                        print(f"[red]Whisper isn't available, so {self.name}'s recording was skipped: {whisper_manager.load_error}")
+                        transcriber.discard()
+                        agents_paused = False
+                        continue
+
+                    # Only the last segment should still be left to transcribe
+                    transcribed_audio = transcriber.finish()
 
                     with conversation_lock:
                         if shutdown_flag.is_set():
                             break
-                        transcribed_audio = whisper_manager.audio_to_text(mic_audio)
                         print(f"[teal]Got the following audio from {self.name}:\n{transcribed_audio}")
 
-                        for agent in self.all_agents:
-                            agent.ollama_manager.chat_history.append({"role": "user", "content": f"[{self.name}] {transcribed_audio}"})
-                            agent.ollama_manager.save_chat_to_backup()
+                        conversation_log.append(self.name, transcribed_audio)
                             
                     
                     print(f"[italic magenta] {self.name} has FINISHED speaking.")
@@ -172,7 +461,7 @@ class Human():
                     agents_paused = False
                     random_agent = random.randint(0, len(self.all_agents)-1)
                     print(f"[cyan]Activating Agent {random_agent+1}")
-                    self.all_agents[random_agent].activated = True
+                    self.all_agents[random_agent].activate()
 
                 # check if f6 is pressed then get the newest file in twitch logs and send it to the chatbot and summarize the response
                 if keyboard.is_pressed('f6'):
@@ -183,36 +472,31 @@ class Human():
 
                     print(f"[italic green] {self.name} has STARTED speaking.")
                   
+                    # The chat viewer publishes which log is current, so there's no need to scan the folder (or hold the lock while reading)
+                    log_path = find_current_log(os.path.join(os.path.abspath(os.curdir), "twitch_logs"))
+                    chat_text = ""
+                    if log_path is not None:
+                        print(log_path)
+                        # Only the chat since the last summary, capped so the summary doesn't get more expensive over the stream
+                        chat_text = chat_digester.digest(twitch_log_reader.read_new_lines(log_path))
+
                     with conversation_lock:
-                        # look in the twitch logs folder and get the newest file
                         if shutdown_flag.is_set():
                             break
 
-                        newest_file = ""
-                        for file in os.listdir(os.path.join(os.path.abspath(os.curdir), "twitch_logs")):
-                            if file.endswith(".log"):
-                                # get the time of the file
-                                # if the time is greater than the newest time then set the newest file to the current file
-                                # if the time is less than the newest time then continue
-                                if newest_file == "":
-                                    newest_file = file
-                                else:
-                                    if os.path.getctime(os.path.join(os.path.abspath(os.curdir), "twitch_logs", file)) > os.path.getctime(os.path.join(os.path.abspath(os.curdir), "twitch_logs", newest_file)):
-                                        newest_file = file
-                        
-                        print(os.path.join(os.path.abspath(os.curdir), "twitch_logs", newest_file))
-                        with open(os.path.join(os.path.abspath(os.curdir), "twitch_logs", newest_file), "r") as f:
-                            chat_text = f.read()
-
-                        for agent in self.all_agents:
-                            agent.ollama_manager.chat_history.append({"role": "user", "content": f"[{self.name}] Summerize chat and give an answer to what you think is the question and 'chat' is there name and add a spin on how you feel about it: {chat_text}"})
-                            agent.ollama_manager.save_chat_to_backup()
+                        if chat_text:
+                            conversation_log.append(self.name, f"Summerize chat and give an answer to what you think is the question and 'chat' is there name and add a spin on how you feel about it: {chat_text}")
                         
                     print(f"[italic magenta] {self.name} has FINISHED speaking.")
 
+                    if not chat_text:
+                        print("[italic red] No new chat since the last summary")
+                        time.sleep(1)
+                        continue
+
                     random_agent = random.randint(0, len(self.all_agents)-1)
                     print(f"[cyan]Activating Agent {random_agent+1}")
-                    self.all_agents[random_agent].activated = True
+                    self.all_agents[random_agent].activate()
 
                 if keyboard.is_pressed('f4'):
                     print("[italic red] Agents have been paused")
@@ -222,7 +506,7 @@ class Human():
                 if keyboard.is_pressed('num 1'):
                     print("[cyan]Activating Agent 1")
                     agents_paused = False
-                    self.all_agents[0].activated = True
+                    self.all_agents[0].activate()
                     time.sleep(1)
 
                 time.sleep(0.05)
@@ -240,16 +524,31 @@ def signal_handler(signum, frame):
     os.system('taskkill /f /im python.exe /fi "WINDOWTITLE eq Twitch Chat Viewer" 1>nul 2>&1')
     shutdown_flag.set()
     flask_shutdown_flag.set()
+    cancel_agents()
+
+def cancel_agents():
+    # Wake up every agent thread so it can exit instead of waiting for another activation
+    for agent in all_agents:
+        agent.cancel()
 
 def start_bot(bot):
     bot.run()
 
+def save_state():
+    # Every way out ends in os._exit, which skips atexit handlers, so anything unsaved has to be written here
+    try:
+        elevenlabs_manager.tts_cache.flush()
+    except Exception as e:
+        print(f"[red]Error saving the TTS cache index: {str(e)}")
+
 def cleanup():
     print("[yellow]Cleaning up resources...")
+    save_state()
     try:
         # Force stop the Flask-SocketIO server
         if not flask_shutdown_flag.is_set():
             flask_shutdown_flag.set()
+        cancel_agents()
         
         # Stop all threads
         for thread in all_threads:
@@ -271,11 +570,14 @@ def cleanup():
 
 def flask_thread():
     try:
+        # The relay has to run on the server's own thread
+        overlay.start()
         socketio.run(app)
     except Exception as e:
         print(f"[red]Flask error: {str(e)}")
     finally:
         if shutdown_flag.is_set():
+            save_state()
             os._exit(0)
 
 if __name__ == '__main__':
@@ -293,9 +595,6 @@ if __name__ == '__main__':
     # Register cleanup function
     atexit.register(cleanup)
 
-    # Initialize all_agents list before creating agents
-    all_agents = []
-
     try:
 
 
@@ -316,6 +615,19 @@ if __name__ == '__main__':
         # Add agent to all_agents list after creation
         all_agents.append(agent1)
 
+        # Load the model into Ollama in the background so the first agent turn doesn't pay the model load cost
+        warm_up_thread = threading.Thread(target=agent1.ollama_manager.warm_up)
+        warm_up_thread.daemon = True
+        warm_up_thread.start()
+
+        # Chat @mentioning an agent is ranked higher when digesting chat
+        chat_digester.mention_names.update(agent.name.lower() for agent in all_agents)
+
+        # Same for the agents' voice settings, so the first line each agent says doesn't wait on the Elevenlabs API
+        voice_prefetch_thread = threading.Thread(target=elevenlabs_manager.prefetch_voices, args=([agent.voice for agent in all_agents],))
+        voice_prefetch_thread.daemon = True
+        voice_prefetch_thread.start()
+
         # Human thread
         human = Human("Liv", all_agents)
         human_thread = threading.Thread(target=start_bot, args=(human,))
@@ -341,6 +653,7 @@ if __name__ == '__main__':
 
         shutdown_flag.set()
         flask_shutdown_flag.set()
+        cancel_agents()
     
     except Exception as e:
         print(f"[red]Error in main thread: {str(e)}")
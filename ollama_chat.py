@@ -1,31 +1,129 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib.parse import urlsplit
 import json
-import os
 from rich import print
 import base64
 import sys
-from typing import List, Dict, Union, Optional
+import threading
+import time
+from typing import List, Dict, Union, Optional, Iterator
+
+from chat_journal import ChatJournal
+from token_budget import MessageTokenCache, estimate_tokens, MESSAGE_OVERHEAD_TOKENS
+from sentences import SentenceBuffer
+
+THINK_START = "<think>"
+THINK_END = "</think>"
+
+# Time spent opening new TCP connections on the current thread, read back for the latency breakdown.
+# Stays at 0 when a request reuses a kept-alive connection from the pool.
+_connect_timing = threading.local()
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _connect_timing.seconds = getattr(_connect_timing, "seconds", 0.0) + time.perf_counter() - start
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _connect_timing.seconds = getattr(_connect_timing, "seconds", 0.0) + time.perf_counter() - start
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose pooled connections record how long they took to connect"""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _TimedHTTPConnectionPool, "https": _TimedHTTPSConnectionPool}
+
+# One pooled keep-alive session per base URL, shared by every OllamaManager (and so every agent)
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+def get_session(base_url: str, pool_size: int = 8) -> requests.Session:
+    """
+    Get the shared pooled session for a base URL, creating it the first time it's needed.
+
+    Args:
+        base_url (str): Any URL on the server, only the scheme and host are used as the key
+        pool_size (int, optional): Number of kept-alive connections to hold for the server
+
+    Returns:
+        requests.Session: Session that reuses its TCP connections between requests
+    """
+    parts = urlsplit(base_url)
+    key = f"{parts.scheme}://{parts.netloc}"
+    with _sessions_lock:
+        if key not in _sessions:
+            session = requests.Session()
+            adapter = _TimedHTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[key] = session
+        return _sessions[key]
 
 class OllamaManager:
-    def __init__(self, system_prompt=None, chat_history_backup=None, model="deepseek-r1:8b"):
+    def __init__(self, system_prompt=None, chat_history_backup=None, model="deepseek-r1:8b",
+                 base_url="http://localhost:11434/api", connect_timeout=3.05, read_timeout=300, keep_alive="30m",
+                 num_ctx=8192, response_tokens=1024, count_tokens=estimate_tokens, shared_log=None, speaker_name=None):
         """
         Initialize OllamaManager with optional system prompt and chat history backup.
         
         Args:
             system_prompt (str, optional): Initial system prompt for the conversation
             chat_history_backup (str, optional): Path to backup file for chat history
-            model (str, optional): Name of the Ollama model to use. Defaults to "llama2"
+            model (str, optional): Name of the Ollama model to use. Defaults to "deepseek-r1:8b"
+            base_url (str, optional): Ollama API url. Managers with the same server share one pooled session
+            connect_timeout (float, optional): Seconds to wait for the TCP connection to Ollama
+            read_timeout (float, optional): Seconds to wait between bytes of Ollama's response
+            keep_alive (str, optional): How long Ollama should keep the model loaded after each request
+            num_ctx (int, optional): Context window size to request from Ollama
+            response_tokens (int, optional): Part of the context window kept free for the reply. The rest is the prompt token budget
+            count_tokens (callable, optional): Returns the token count of a string. Defaults to a ~4 characters per token estimate
+            shared_log (ConversationLog, optional): Shared transcript of the conversation. When provided, chat_history only holds
+                this manager's system prompt and private prompts, and replies are added to the shared transcript as speaker_name
+            speaker_name (str, optional): Name this manager speaks as in the shared transcript
         """
-        self.base_url = "http://localhost:11434/api"
+        self.base_url = base_url
         self.model = model
+        self.session = get_session(base_url)
+        self.timeout = (connect_timeout, read_timeout)
+        self.keep_alive = keep_alive
+        # Latency breakdown of the most recent request in seconds: connect, ttfb (time to first byte), first_token (streaming only) and total
+        self.last_latency: Dict[str, float] = {}
+        self.num_ctx = num_ctx
+        self.token_budget = num_ctx - response_tokens
+        self.count_tokens = count_tokens
+        # Token counts are cached per message, so each turn only has to count the messages that are new
+        self.token_cache = MessageTokenCache(lambda chat: self.count_tokens(self._message_text(chat)) + MESSAGE_OVERHEAD_TOKENS)
+        # How much of the history was left out of the most recent request to stay within the token budget
+        self.last_trim = {"messages": 0, "tokens": 0, "prompt_tokens": 0}
         self.logging = True
+        # The most recent reply generated with commit=False
+        self.last_draft: Optional[str] = None
         self.chat_history: List[Dict[str, str]] = []
+        self.shared_log = shared_log
+        self.speaker_name = speaker_name
+        # Our own utterances in the shared transcript, as assistant messages. Built once per entry and reused every request
+        self._own_views: Dict[int, Dict[str, str]] = {}
         self.chat_history_backup = chat_history_backup
+        # The backup is an append-only journal, so saving doesn't rewrite the whole history every time
+        self.chat_journal = ChatJournal(chat_history_backup) if chat_history_backup else None
 
         # Load chat history from backup if it exists
-        if chat_history_backup and os.path.exists(chat_history_backup):
-            with open(chat_history_backup, 'r') as file:
-                self.chat_history = json.load(file)
+        backup_history = self.chat_journal.load() if self.chat_journal else None
+        if backup_history is not None:
+            self.chat_history = backup_history
         elif system_prompt:
             self.chat_history.append({
                 "role": "system",
@@ -33,10 +131,219 @@ class OllamaManager:
             })
 
     def save_chat_to_backup(self):
-        """Save current chat history to backup file if specified"""
-        if self.chat_history_backup:
-            with open(self.chat_history_backup, 'w') as file:
-                json.dump(self.chat_history, file)
+        """Save any new chat history messages to the backup journal if specified"""
+        if self.chat_journal:
+            self.chat_journal.sync(self.chat_history)
+
+    @staticmethod
+    def _strip_think(message: str) -> str:
+        """Remove every <think>...</think> block from a reply. An unclosed <think> block removes the rest of the reply."""
+        while THINK_START in message:
+            start = message.find(THINK_START)
+            end = message.find(THINK_END, start)
+            if end == -1:
+                message = message[:start]
+            else:
+                message = message[:start] + message[end+len(THINK_END):]
+        return message.strip()
+
+    @staticmethod
+    def _visible_text(raw: str) -> str:
+        """
+        Returns the part of a partially streamed reply that is safe to show.
+        Finished <think> blocks are removed, everything after an unfinished one is held back,
+        and so is a trailing fragment that could still turn into a <think> tag.
+        """
+        visible = ""
+        position = 0
+        while True:
+            start = raw.find(THINK_START, position)
+            if start == -1:
+                break
+            visible += raw[position:start]
+            end = raw.find(THINK_END, start)
+            if end == -1:
+                return visible
+            position = end + len(THINK_END)
+        visible += raw[position:]
+        for i in range(len(THINK_START) - 1, 0, -1):
+            if visible.endswith(THINK_START[:i]):
+                return visible[:-i]
+        return visible
+
+    def _add_prompt_to_history(self, prompt: Optional[str]):
+        """Add a new user prompt to chat history if one was provided"""
+        if prompt:
+            message = {
+                "role": "user",
+                "content": prompt
+            }
+            if self.shared_log is not None:
+                # Private prompts remember where they were asked in the shared transcript
+                message["log_index"] = len(self.shared_log)
+            self.chat_history.append(message)
+
+    def _request_history(self) -> List[Dict]:
+        """
+        The full conversation from this manager's point of view.
+        Without a shared log that's just chat_history. With one, our private messages are merged into the shared transcript
+        at the position they were added, and our own utterances become assistant messages.
+        The shared entries are used as they are rather than copied.
+        """
+        if self.shared_log is None:
+            return self.chat_history
+
+        shared = self.shared_log.entries[:len(self.shared_log)]
+        history = []
+        shared_position = 0
+        for chat in self.chat_history:
+            # Messages without a log_index (the system prompt, older backups) come before the shared transcript
+            log_index = min(chat.get("log_index", 0), len(shared))
+            while shared_position < log_index:
+                history.append(self._shared_view(shared_position, shared[shared_position]))
+                shared_position += 1
+            history.append(chat)
+        while shared_position < len(shared):
+            history.append(self._shared_view(shared_position, shared[shared_position]))
+            shared_position += 1
+        return history
+
+    def _shared_view(self, index: int, entry: Dict[str, str]) -> Dict[str, str]:
+        """Returns a shared transcript entry as a chat message from this manager's point of view"""
+        if entry["speaker"] != self.speaker_name:
+            return entry
+        if index not in self._own_views:
+            self._own_views[index] = {"role": "assistant", "content": entry["text"]}
+        return self._own_views[index]
+
+    @staticmethod
+    def _message_text(chat: Dict) -> str:
+        """Get the text of a chat history message, whatever format its content is in"""
+        # check if content is not a string
+        if isinstance(chat['content'], str) == False:
+            # check if content is a list
+            # check if there is a 0th element in the list
+            if isinstance(chat['content'], list) and len(chat['content']) > 0:
+                return chat['content'][0]["text"]
+            return chat['content']["content"]
+        return chat['content']
+
+    def _build_messages(self) -> List[Dict[str, str]]:
+        """
+        Convert chat history into the Ollama message format, keeping the prompt within the token budget.
+        System messages are always kept. The other messages are dropped oldest-first once they don't fit.
+        The newest message is what the model has to answer, so it's always kept, cut short if it doesn't fit on its own.
+        """
+        history = self._request_history()
+        system_messages = [chat for chat in history if chat['role'] == "system"]
+        other_messages = [chat for chat in history if chat['role'] != "system"]
+
+        prompt_tokens = sum(self.token_cache.count(chat) for chat in system_messages)
+        # Walk back from the newest message until the budget is used up
+        kept = 0
+        truncated_texts = {}
+        for chat in reversed(other_messages):
+            tokens = self.token_cache.count(chat)
+            if prompt_tokens + tokens > self.token_budget:
+                if kept == 0:
+                    text = self._truncate_text(self._message_text(chat), self.token_budget - prompt_tokens - MESSAGE_OVERHEAD_TOKENS)
+                    print(f"[red]The newest message ({tokens} tokens) doesn't fit the {self.token_budget} token budget, sending only its first {len(text)} characters")
+                    truncated_texts[id(chat)] = text
+                    prompt_tokens += self.count_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+                    kept = 1
+                break
+            prompt_tokens += tokens
+            kept += 1
+        window = other_messages[len(other_messages)-kept:]
+        window_ids = set(id(chat) for chat in window)
+
+        trimmed_messages = len(other_messages) - kept
+        trimmed_tokens = sum(self.token_cache.count(chat) for chat in other_messages[:trimmed_messages])
+        if trimmed_messages != self.last_trim["messages"]:
+            print(f"[coral]Trimmed {trimmed_messages} old messages ({trimmed_tokens} tokens) to fit the {self.token_budget} token budget")
+        self.last_trim = {"messages": trimmed_messages, "tokens": trimmed_tokens, "prompt_tokens": prompt_tokens}
+
+        messages = []
+        for chat in history:
+            if chat['role'] == "system" or id(chat) in window_ids:
+                messages.append({
+                    "role": chat['role'],
+                    "content": truncated_texts.get(id(chat), self._message_text(chat))
+                })
+        return messages
+
+    def _truncate_text(self, text: str, max_tokens: int) -> str:
+        """The longest start of the text that fits in max_tokens"""
+        if max_tokens <= 0:
+            return ""
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(text[:middle]) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:low]
+
+    def _add_reply_to_history(self, message: str):
+        """Add the model's reply to chat history (or the shared transcript) and save it to backup if enabled"""
+        if self.shared_log is not None:
+            self.shared_log.append(self.speaker_name, message)
+        else:
+            self.chat_history.append({
+                "role": "assistant",
+                "content": message
+            })
+        self.save_chat_to_backup()
+
+        if self.logging:
+            print(f"[green]\n{message}\n")
+
+    def _post(self, endpoint: str, payload: dict, stream: bool = False) -> requests.Response:
+        """
+        POST to the Ollama API through the pooled session and start a new latency breakdown.
+        For non-streaming requests the breakdown is complete when this returns. Streaming callers
+        should call _finish_latency once they have read the whole response.
+        """
+        payload["keep_alive"] = self.keep_alive
+        _connect_timing.seconds = 0.0
+        self._request_start = time.perf_counter()
+        response = self.session.post(f"{self.base_url}/{endpoint}", json=payload, timeout=self.timeout, stream=stream)
+        self.last_latency = {
+            "connect": _connect_timing.seconds,
+            "ttfb": response.elapsed.total_seconds(),
+        }
+        if not stream:
+            self._finish_latency()
+        return response
+
+    def _finish_latency(self):
+        """Record the total time of the current request and log the breakdown"""
+        self.last_latency["total"] = time.perf_counter() - self._request_start
+        if self.logging:
+            print(f"[grey50]Ollama latency: {self.format_latency()}")
+
+    def format_latency(self) -> str:
+        """Returns the latency breakdown of the most recent request as a short string for logging"""
+        return ", ".join(f"{name} {seconds*1000:.0f}ms" for name, seconds in self.last_latency.items())
+
+    def warm_up(self) -> bool:
+        """
+        Preload the model into Ollama so the first real request doesn't pay the model load cost.
+        Sending a generate request without a prompt makes Ollama load the model and keep it for keep_alive.
+
+        Returns:
+            bool: True if the model is loaded
+        """
+        try:
+            print(f"[yellow]\nLoading {self.model} into Ollama...")
+            response = self._post("generate", {"model": self.model})
+            response.raise_for_status()
+            print(f"[green]{self.model} is loaded ({self.format_latency()})")
+            return True
+        except Exception as e:
+            print(f"[red]Error warming up Ollama: {str(e)}")
+            return False
 
     def chat(self, prompt: str) -> Optional[str]:
         """
@@ -58,23 +365,15 @@ class OllamaManager:
         }
         try:
             print("[yellow]\nAsking Ollama a question...")
-            response = requests.post(
-                f"{self.base_url}/chat",
-                json={
-                    "model": self.model,
-                    "content": prompt_content,
-                    "stream": False
-                }
-            )
+            response = self._post("chat", {
+                "model": self.model,
+                "content": prompt_content,
+                "stream": False
+            })
             response.raise_for_status()
             result = response.json()
             
-            message = result['message']['content']
-            while "<think>" in message:
-                start = message.find("<think>")
-                end = message.find("</think>")
-                message = message[:start] + message[end+8:]
-            message = message.strip()
+            message = self._strip_think(result['message']['content'])
 
             result['message']['content'] = message
             # Add response to chat history
@@ -99,73 +398,97 @@ class OllamaManager:
             str: The model's response or None if there's an error
         """
         try:
-            # Add new prompt to chat history if provided
-            if prompt:
-                self.chat_history.append({
-                    "role": "user",
-                    "content": prompt
-                })
-
-            # Prepare messages in Ollama format
-            messages = []
-            for chat in self.chat_history:
-                # check if content is not a string
-                if isinstance(chat['content'], str) == False:
-                    # check if content is a list
-                    # check if there is a 0th element in the list
-                    if isinstance(chat['content'], list) and len(chat['content']) > 0:
-                        messages.append({
-                            "role": chat['role'],
-                            "content": chat['content'][0]["text"]
-                        })
-                    else:
-                        messages.append({
-                            "role": chat['role'],
-                            "content": chat['content']["content"]
-                        })
-                else:
-                    messages.append({
-                        "role": chat['role'],
-                        "content": chat['content']
-                    })
+            self._add_prompt_to_history(prompt)
+            messages = self._build_messages()
 
             print("[yellow]\nAsking Ollama a question...")
-            response = requests.post(
-                f"{self.base_url}/chat",
-                json={
-                    "model": self.model,
-                    "messages": messages,
-                    "stream": False
-                }
-            )
+            response = self._post("chat", {
+                "model": self.model,
+                "messages": messages,
+                "stream": False,
+                "options": {"num_ctx": self.num_ctx}
+            })
             response.raise_for_status()
             result = response.json()
 
-            # remove any of the <think> tags from the response its
-            message = result['message']['content']
-            while "<think>" in message:
-                start = message.find("<think>")
-                end = message.find("</think>")
-                message = message[:start] + message[end+8:]
-            message = message.strip()
+            # remove any of the <think> tags from the response
+            message = self._strip_think(result['message']['content'])
+            self._add_reply_to_history(message)
+            return message
 
-            result['message']['content'] = message
-            # Add response to chat history
-            self.chat_history.append({
-                "role": "assistant",
-                "content": result['message']['content']
-            })
+        except Exception as e:
+            print(f"[red]Error during Ollama request: {str(e)} on line {sys.exc_info()[-1].tb_lineno}")
+            return None
 
-            # Save to backup if enabled
-            self.save_chat_to_backup()
+    def chat_with_history_stream(self, prompt: Optional[str] = "", commit: bool = True) -> Iterator[str]:
+        """
+        Streaming version of chat_with_history. Reads Ollama's NDJSON chunks as they are generated
+        and yields every sentence of the reply as soon as it is complete, so the caller can start
+        working on the first sentence while the rest is still being generated.
+        Once the reply is finished it is added to chat history and backed up, exactly like chat_with_history.
 
-            if self.logging:
-                print(f"[green]\n{result['message']['content']}\n")
-            return result['message']['content']
+        Args:
+            prompt (str, optional): The new message to send. If empty, continues the conversation.
+            commit (bool, optional): If False, this is a draft: neither the prompt nor the reply are added to history.
+                The finished reply is left in last_draft, and can be added later with commit_draft
+
+        Yields:
+            str: Each complete sentence of the model's response. Nothing is yielded if there's an error
+        """
+        try:
+            self._add_prompt_to_history(prompt)
+            messages = self._build_messages()
+            if not commit and prompt:
+                # The prompt is only part of this request until the draft is committed
+                self.token_cache.forget(self.chat_history.pop())
+
+            print("[yellow]\nAsking Ollama a question (streaming)...")
+            response = self._post("chat", {
+                "model": self.model,
+                "messages": messages,
+                "stream": True,
+                "options": {"num_ctx": self.num_ctx}
+            }, stream=True)
+            response.raise_for_status()
+
+            raw_message = ""
+            visible_length = 0
+            sentence_buffer = SentenceBuffer()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if "first_token" not in self.last_latency:
+                    self.last_latency["first_token"] = time.perf_counter() - self._request_start
+                raw_message += chunk.get('message', {}).get('content', "")
+
+                # Only pass on text that is outside of <think> blocks
+                visible = self._visible_text(raw_message)
+                for sentence in sentence_buffer.feed(visible[visible_length:]):
+                    yield sentence
+                visible_length = len(visible)
+
+            self._finish_latency()
+
+            last_sentence = sentence_buffer.flush()
+            if last_sentence:
+                yield last_sentence
+
+            if commit:
+                self._add_reply_to_history(self._strip_think(raw_message))
+            else:
+                self.last_draft = self._strip_think(raw_message)
 
         except Exception as e:
-            print(f"[red]Error during Ollama request: {str(e)} on line {sys.exc_info()[-1].tb_lineno}")
-            return None
+            print(f"[red]Error during Ollama streaming request: {str(e)} on line {sys.exc_info()[-1].tb_lineno}")
+
+    def commit_draft(self, prompt: Optional[str], reply: str):
+        """
+        Add a drafted exchange (see chat_with_history_stream with commit=False) to history, as if it had just been generated.
+        Only do this if the conversation hasn't changed since the draft was made, otherwise the reply may not fit anymore.
+        """
+        self._add_prompt_to_history(prompt)
+        self._add_reply_to_history(reply)
 
     def analyze_image(self, prompt: str, image_path: str, local_image: bool = True) -> Optional[str]:
         """
@@ -191,7 +514,8 @@ class OllamaManager:
             else:
                 # For URLs, download the image first
                 try:
-                    response = requests.get(image_path)
+                    # A plain request, image hosts are arbitrary and one-off so a pooled session per host would only pile up
+                    response = requests.get(image_path, timeout=self.timeout)
                     response.raise_for_status()
                     base64_image = base64.b64encode(response.content).decode("utf-8")
                 except Exception as e:
@@ -199,15 +523,12 @@ class OllamaManager:
                     return None
 
             print("[yellow]\nAsking Ollama to analyze image...")
-            response = requests.post(
-                f"{self.base_url}/generate",
-                json={
-                    "model": self.model,
-                    "prompt": prompt,
-                    "images": [base64_image],
-                    "stream": False
-                }
-            )
+            response = self._post("generate", {
+                "model": self.model,
+                "prompt": prompt,
+                "images": [base64_image],
+                "stream": False
+            })
             response.raise_for_status()
             result = response.json()
 
@@ -4,7 +4,9 @@ import os
 from rich import print
 import base64
 import time
-import json
+
+from chat_journal import ChatJournal
+from token_budget import MessageTokenCache
 
 class OpenAiManager:
     
@@ -19,25 +21,34 @@ class OpenAiManager:
         self.client = OpenAI(api_key=os.environ['OPENAI_API_KEY'])
         self.logging = True # Determines whether the module should print out its results
         self.tiktoken_encoder = None # Used to calculate the token count in messages
+        self.max_tokens = 128000 # Context limit of gpt-4o, older messages are removed to stay under it
+        # Trimming goes down to this share of max_tokens, so the next turns have room and don't each trim (and rewrite the backup) again
+        self.trim_to = 0.9
         self.chat_history = []
+        # Token counts are cached per message, and the total for the whole history is kept up to date as messages are added or removed
+        self.token_cache = MessageTokenCache(self.num_tokens_from_message)
+        self.history_tokens = 0
+        self._counted_messages = 0
+        self._last_counted = None
 
         # If a backup file is provided, we will save our chat history to that file after every call
+        # New messages are appended to a journal next to the backup file, which gets compacted back into the backup every so often
         self.chat_history_backup = chat_history_backup
+        self.chat_journal = ChatJournal(chat_history_backup) if chat_history_backup else None
         
-        # If the backup file already exists, we load its contents into the chat_history
-        if chat_history_backup and os.path.exists(chat_history_backup):
-            with open(chat_history_backup, 'r') as file:
-                self.chat_history = json.load(file)
+        # If the backup file already exists, we load its contents (plus any journaled messages) into the chat_history
+        backup_history = self.chat_journal.load() if self.chat_journal else None
+        if backup_history is not None:
+            self.chat_history = backup_history
         elif system_prompt:
             # If the chat history file doesn't exist, then our chat history is currently empty.
             # If we were provided a system_prompt, add it into the chat history as the first message.
             self.chat_history.append(system_prompt)
 
-    # Write our current chat history to the txt file
+    # Write any new chat history messages to the backup journal
     def save_chat_to_backup(self):
-        if self.chat_history_backup:
-            with open(self.chat_history_backup, 'w') as file:
-                json.dump(self.chat_history, file)
+        if self.chat_journal:
+            self.chat_journal.sync(self.chat_history)
 
     def num_tokens_from_messages(self, messages, model='gpt-4o'):
         """Returns the number of tokens used by a list of messages.
@@ -57,35 +68,78 @@ class OpenAiManager:
             'content' = [{'type': 'text', 'text': 'Okay now please compare the previous image I sent you with this new image!'}, {'type': 'image_url', 'image_url': {'url': 'https://i.gyazo.com/8ec349446dbb538727e515f2b964224c.png', 'detail': 'high'}}]
         """
         try:
-            if self.tiktoken_encoder == None:
-                self.tiktoken_encoder = tiktoken.encoding_for_model(model) # We store this value so we don't have to check again every time
             num_tokens = 0
             for message in messages:
-                num_tokens += 4  # every message follows <im_start>{role/name}\n{content}<im_end>\n
-                for key, value in message.items():
-                    if key == 'role':
-                        num_tokens += len(self.tiktoken_encoder.encode(value))
-                    elif key == 'content':
-                        # In the case that value is just a string, simply get its token value and move on
-                        if isinstance(value, str):
-                            num_tokens += len(self.tiktoken_encoder.encode(value))
-                            continue
-
-                        # In this case the 'content' variables value is an array of dictionaries
-                        for message_data in value:
-                            for content_key, content_value in message_data.items():
-                                if content_key == 'type':
-                                    num_tokens += len(self.tiktoken_encoder.encode(content_value))
-                                elif content_key == 'text': 
-                                    num_tokens += len(self.tiktoken_encoder.encode(content_value))
-                                elif content_key == "image_url":
-                                    num_tokens += 1105 # Assumes the image is 1920x1080 and that detail is set to high               
+                num_tokens += self.num_tokens_from_message(message, model)
             num_tokens += 2  # every reply is primed with <im_start>assistant
             return num_tokens
         except Exception:
             # Either this model is not implemented in tiktoken, or there was some error processing the messages
             raise NotImplementedError(f"""num_tokens_from_messages() is not presently implemented for model {model}.""")
 
+    # Returns the number of tokens used by a single message. See num_tokens_from_messages for the message formats.
+    def num_tokens_from_message(self, message, model='gpt-4o'):
+        if self.tiktoken_encoder == None:
+            self.tiktoken_encoder = tiktoken.encoding_for_model(model) # We store this value so we don't have to check again every time
+        num_tokens = 4  # every message follows <im_start>{role/name}\n{content}<im_end>\n
+        for key, value in message.items():
+            if key == 'role':
+                num_tokens += len(self.tiktoken_encoder.encode(value))
+            elif key == 'content':
+                # In the case that value is just a string, simply get its token value and move on
+                if isinstance(value, str):
+                    num_tokens += len(self.tiktoken_encoder.encode(value))
+                    continue
+
+                # In this case the 'content' variables value is an array of dictionaries
+                for message_data in value:
+                    for content_key, content_value in message_data.items():
+                        if content_key == 'type':
+                            num_tokens += len(self.tiktoken_encoder.encode(content_value))
+                        elif content_key == 'text': 
+                            num_tokens += len(self.tiktoken_encoder.encode(content_value))
+                        elif content_key == "image_url":
+                            num_tokens += 1105 # Assumes the image is 1920x1080 and that detail is set to high               
+        return num_tokens
+
+    # Add a message to the chat history and to the running token total
+    def add_message(self, message):
+        self.chat_history.append(message)
+        self._sync_history_tokens()
+
+    # Bring the running token total of the chat history up to date.
+    # Each message is only tokenized once (when it's first seen), so messages appended straight onto chat_history
+    # by other code are picked up here at the cost of counting just those new messages.
+    def _sync_history_tokens(self):
+        counted = self._counted_messages
+        if counted <= len(self.chat_history) and (counted == 0 or self.chat_history[counted - 1] is self._last_counted):
+            for message in self.chat_history[counted:]:
+                self.history_tokens += self.token_cache.count(message)
+        else:
+            # The history was changed in some other way, so total it up again from the cached counts
+            self.history_tokens = sum(self.token_cache.count(message) for message in self.chat_history)
+        self._counted_messages = len(self.chat_history)
+        self._last_counted = self.chat_history[-1] if self.chat_history else None
+
+    # Once the chat history is over max_tokens, remove old messages until it's down to trim_to of max_tokens.
+    # Trimming rewrites the backup snapshot (the journal can only append), so it's done in batches rather than one message every turn.
+    # The running total is updated per removed message instead of recounting the whole history after every removal.
+    def trim_chat_history(self):
+        self._sync_history_tokens()
+        if self.history_tokens + 2 <= self.max_tokens:
+            return
+        target = int(self.max_tokens * self.trim_to)
+        end = 1 # We skip the 1st message since it's the system message
+        while self.history_tokens + 2 > target and end < len(self.chat_history):
+            self.history_tokens -= self.token_cache.count(self.chat_history[end])
+            self.token_cache.forget(self.chat_history[end])
+            end += 1
+        del self.chat_history[1:end]
+        if self.logging:
+            print(f"Popped {end - 1} messages! New token length is: {self.history_tokens + 2}")
+        self._counted_messages = len(self.chat_history)
+        self._last_counted = self.chat_history[-1] if self.chat_history else None
+
     # Asks a question with no chat history
     def chat(self, prompt=""):
         if not prompt:
@@ -192,15 +246,13 @@ class OpenAiManager:
                 new_chat_message["content"].append(new_image_content)
 
             # Add the new message into our chat history
-            self.chat_history.append(new_chat_message)
+            self.add_message(new_chat_message)
 
         # Check total token limit. Remove old messages as needed
+        self._sync_history_tokens()
         if self.logging:
-            print(f"[coral]Chat History has a current token length of {self.num_tokens_from_messages(self.chat_history)}")
-        while self.num_tokens_from_messages(self.chat_history) > 128000:
-            self.chat_history.pop(1) # We skip the 1st message since it's the system message
-            if self.logging:
-                print(f"Popped a message! New token length is: {self.num_tokens_from_messages(self.chat_history)}")
+            print(f"[coral]Chat History has a current token length of {self.history_tokens + 2}")
+        self.trim_chat_history()
 
         if self.logging:
             print("[yellow]\nAsking ChatGPT a question...")
@@ -210,7 +262,7 @@ class OpenAiManager:
         )
 
         # Add this answer to our chat history
-        self.chat_history.append({"role": completion.choices[0].message.role, "content": completion.choices[0].message.content})
+        self.add_message({"role": completion.choices[0].message.role, "content": completion.choices[0].message.content})
 
         # If a backup file was provided, write out convo history to the txt file
         self.save_chat_to_backup()
@@ -220,4 +272,56 @@ class OpenAiManager:
         if self.logging:
             print(f"[green]\n{openai_answer}\n")
         return openai_answer
-    
+
+
+class WhitespaceEncoder:
+    """Stand-in for the tiktoken encoder that counts words, for benchmarking when tiktoken can't download its encoding files"""
+    def encode(self, text):
+        return text.split()
+
+
+def benchmark_trimming(sizes=(1000, 10000), legacy_sizes=(1000,), stand_in_encoder=False):
+    """
+    Micro-benchmark of trimming the chat history down to max_tokens.
+    Each history has half again as many tokens as the limit allows, so about a third of the messages get popped.
+    The old trimming loop (recount the whole history after every pop) is timed for comparison at legacy_sizes,
+    it is quadratic so it's too slow to run at 10k messages.
+    Uses tiktoken, or WhitespaceEncoder with stand_in_encoder=True (python openai_chat.py --stand-in-encoder).
+    """
+    os.environ.setdefault('OPENAI_API_KEY', 'benchmark') # The client is never used, it just needs a key to be created
+    sample_text = "Honestly the greatest videogame of all time is obviously the one with the best soundtrack, fight me."
+    print(f"Counting tokens with {'WhitespaceEncoder' if stand_in_encoder else 'tiktoken'}")
+
+    def build_manager(size):
+        manager = OpenAiManager({"role": "system", "content": "You are a benchmark."})
+        manager.logging = False
+        if stand_in_encoder:
+            manager.tiktoken_encoder = WhitespaceEncoder()
+        for i in range(size):
+            manager.chat_history.append({"role": "user", "content": [{"type": "text", "text": f"{i} {sample_text}"}]})
+        manager.max_tokens = int(manager.num_tokens_from_messages(manager.chat_history) / 1.5)
+        return manager
+
+    for size in sizes:
+        manager = build_manager(size)
+        start = time.perf_counter()
+        manager.trim_chat_history()
+        first_trim = time.perf_counter() - start
+        # Next turn: one new message, which fits in the room the batched trim left
+        manager.chat_history.append({"role": "user", "content": [{"type": "text", "text": sample_text}]})
+        start = time.perf_counter()
+        manager.trim_chat_history()
+        next_trim = time.perf_counter() - start
+        print(f"{size} messages: first trim {first_trim*1000:.1f}ms (counts every message once), next turn {next_trim*1000:.3f}ms")
+
+    for size in legacy_sizes:
+        manager = build_manager(size)
+        start = time.perf_counter()
+        while manager.num_tokens_from_messages(manager.chat_history) > manager.max_tokens:
+            manager.chat_history.pop(1)
+        print(f"{size} messages: old recount-after-every-pop trim {(time.perf_counter() - start)*1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    import sys
+    benchmark_trimming(stand_in_encoder="--stand-in-encoder" in sys.argv)
@@ -0,0 +1,215 @@
+import importlib.util
+import queue
+import socket
+import threading
+from typing import List, Optional
+
+from rich import print
+
+# The overlay server's Socket.IO backends. "threading" runs on Werkzeug with a thread per client, "eventlet" and "gevent"
+# serve every overlay from one thread with green threads, which holds up much better with lots of overlays open
+ASYNC_MODES = ("threading", "eventlet", "gevent")
+
+
+def resolve_async_mode(requested: Optional[str]) -> str:
+    """Falls back to threading if the requested backend is unknown or not installed"""
+    mode = (requested or "threading").strip().lower()
+    if mode not in ASYNC_MODES:
+        print(f"[red]Unknown Socket.IO async mode '{mode}', using threading. Pick one of: {', '.join(ASYNC_MODES)}")
+        return "threading"
+    if mode != "threading" and importlib.util.find_spec(mode) is None:
+        print(f"[red]{mode} is not installed (pip install {mode}), using threading")
+        return "threading"
+    return mode
+
+
+def websocket_available(async_mode: str) -> bool:
+    if async_mode == "eventlet":
+        return True
+    if async_mode == "gevent" and importlib.util.find_spec("geventwebsocket") is not None:
+        return True
+    return importlib.util.find_spec("simple_websocket") is not None
+
+
+def socket_transports(async_mode: str) -> List[str]:
+    """WebSocket only if the backend can serve it, otherwise let clients fall back to long polling"""
+    if websocket_available(async_mode):
+        return ["websocket"]
+    print("[yellow]WebSocket transport is not available (pip install simple-websocket), overlays will use long polling")
+    return ["polling", "websocket"]
+
+
+def agent_room(agent_id) -> str:
+    return f"agent_{agent_id}"
+
+
+class OverlayEmitter:
+    """
+    Sends overlay events to the room of the agent they're about, so each overlay only gets its own agent's events.
+
+    In threading mode events are emitted straight from the calling thread. The eventlet and gevent servers run on green
+    threads, which must not be written to from the agent threads, so there events are queued and a background task on
+    the server's own thread sends them. The task sleeps in the server's event loop until an agent thread wakes it up by
+    writing a byte to a socket pair (a socket rather than a pipe, so it also works on Windows).
+    """
+
+    def __init__(self, socketio, async_mode: str):
+        self.socketio = socketio
+        self.async_mode = async_mode
+        self.relay = queue.SimpleQueue()
+        self._started = False
+        self._lock = threading.Lock()
+        self._wake_reader = self._wake_writer = None
+        if async_mode != "threading":
+            self._wake_reader, self._wake_writer = socket.socketpair()
+            self._wake_reader.setblocking(False)
+            self._wake_writer.setblocking(False)
+
+    def emit(self, event: str, data: dict, agent_id=None):
+        """
+        Args:
+            event (str): Socket.IO event name
+            data (dict): Event payload
+            agent_id (int, optional): Only overlays that joined this agent's room get the event. Everyone gets it if not given
+        """
+        room = agent_room(agent_id) if agent_id is not None else None
+        if self.async_mode == "threading":
+            self._send(event, data, room)
+        else:
+            self.relay.put((event, data, room))
+            try:
+                self._wake_writer.send(b"\0")
+            except BlockingIOError:
+                # The socket buffer is full of wake-ups the relay hasn't read yet, so it's going to run anyway
+                pass
+
+    def start(self):
+        """Start relaying queued events. Call this from the thread that runs the server, before socketio.run"""
+        with self._lock:
+            if self._started or self.async_mode == "threading":
+                return
+            self._started = True
+        self.socketio.start_background_task(self._relay_events)
+
+    def _wait_readable(self):
+        # Blocks only the relay's green thread, the rest of the server keeps running
+        if self.async_mode == "eventlet":
+            from eventlet.hubs import trampoline
+            return lambda fileno: trampoline(fileno, read=True)
+        from gevent.socket import wait_read
+        return wait_read
+
+    def _relay_events(self):
+        wait_readable = self._wait_readable()
+        while True:
+            wait_readable(self._wake_reader.fileno())
+            # Clear the wake-ups before emptying the queue, so an event queued in between still wakes us up again
+            try:
+                while self._wake_reader.recv(4096):
+                    pass
+            except BlockingIOError:
+                pass
+            while True:
+                try:
+                    event, data, room = self.relay.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    self._send(event, data, room)
+                except Exception as e:
+                    print(f"[red]Error sending {event} to the overlay: {str(e)}")
+
+    def _send(self, event: str, data: dict, room: Optional[str]):
+        self.socketio.emit(event, data, to=room)
+
+
+def bench_overlays(async_mode: str = "threading", overlay_counts=(1, 10, 50, 100), events: int = 200, port: int = 5252):
+    """
+    Load test: starts a bare overlay server, connects more and more overlay clients (spread over three agent rooms) and
+    sends events to agent 1's room from an agent-like thread. Prints how long delivery takes as the overlay count grows,
+    and checks that no overlay got another agent's events. Needs the Socket.IO client: pip install "python-socketio[client]"
+    """
+    import statistics
+    import time
+
+    import socketio as socketio_client
+    from flask import Flask
+    from flask_socketio import SocketIO, join_room
+
+    async_mode = resolve_async_mode(async_mode)
+    transports = socket_transports(async_mode)
+    app = Flask(__name__)
+    server = SocketIO(app, async_mode=async_mode, transports=transports)
+    emitter = OverlayEmitter(server, async_mode)
+
+    @server.on('join_agent')
+    def join_agent(msg):
+        join_room(agent_room(msg['agent_id']))
+
+    def run_server():
+        emitter.start()
+        # Only Werkzeug knows this option (and refuses to start without it when stdin isn't a terminal)
+        options = {"allow_unsafe_werkzeug": True} if async_mode == "threading" else {}
+        server.run(app, host="127.0.0.1", port=port, **options)
+
+    threading.Thread(target=run_server, daemon=True).start()
+    time.sleep(1)
+
+    print(f"[cyan]Socket.IO async mode: {async_mode}, transports: {transports}, {events} events per run")
+    clients = []
+    for overlay_count in overlay_counts:
+        # Connect more overlays until there are overlay_count of them. Every third one watches agent 1
+        while len(clients) < overlay_count:
+            agent_id = len(clients) % 3 + 1
+            client = socketio_client.Client()
+            client.latencies = []
+            client.wrong_room = 0
+
+            def on_event(msg, client=client, agent_id=agent_id):
+                if msg['agent_id'] != agent_id:
+                    client.wrong_room += 1
+                client.latencies.append(time.perf_counter() - msg['sent_at'])
+
+            client.on('agent_turn', on_event)
+            client.connect(f"http://127.0.0.1:{port}", transports=transports)
+            client.emit('join_agent', {'agent_id': agent_id})
+            client.agent_id = agent_id
+            clients.append(client)
+        time.sleep(0.5)
+
+        for client in clients:
+            client.latencies = []
+            client.wrong_room = 0
+        watchers = [client for client in clients if client.agent_id == 1]
+        start_time = time.perf_counter()
+        for _ in range(events):
+            emitter.emit('agent_turn', {'agent_id': 1, 'sent_at': time.perf_counter()}, 1)
+        send_seconds = time.perf_counter() - start_time
+        deadline = time.time() + 30
+        while time.time() < deadline and any(len(client.latencies) < events for client in watchers):
+            time.sleep(0.01)
+        total_seconds = time.perf_counter() - start_time
+
+        latencies = sorted(latency for client in clients for latency in client.latencies)
+        delivered = len(latencies)
+        expected = events * len(watchers)
+        wrong_room = sum(client.wrong_room for client in clients) + sum(len(client.latencies) for client in clients if client.agent_id != 1)
+        if latencies:
+            latency = f"latency p50 {1000 * statistics.median(latencies):.1f}ms p95 {1000 * latencies[int(0.95 * (delivered - 1))]:.1f}ms"
+        else:
+            latency = "no latency, nothing was delivered"
+        print(f"[{'green' if delivered == expected and not wrong_room else 'red'}]{overlay_count:4d} overlays: {delivered}/{expected} delivered "
+              f"in {total_seconds:.3f}s ({delivered / max(total_seconds, 1e-9):.0f} deliveries/s), emit calls took {1000 * send_seconds / max(events, 1):.3f}ms each, "
+              f"{latency}, other rooms' events received: {wrong_room}")
+
+    for client in clients:
+        client.disconnect()
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python overlay_events.py [threading|eventlet|gevent] [overlay counts...]
+    mode = sys.argv[1] if len(sys.argv) > 1 else "threading"
+    counts = [int(count) for count in sys.argv[2:]] or [1, 10, 50, 100]
+    bench_overlays(mode, counts)
@@ -0,0 +1,79 @@
+import re
+from typing import List, Tuple
+
+# A sentence ends at one or more . ! ? characters, optionally followed by closing quotes or brackets, and then whitespace
+SENTENCE_END = re.compile(r'[.!?…]+["\'”’)\]]*\s+')
+
+
+class SentenceBuffer:
+    """
+    Collects text that arrives in small pieces (e.g. streamed LLM tokens) and hands back
+    every sentence as soon as it is complete.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """
+        Add new text to the buffer.
+
+        Args:
+            text (str): The next piece of streamed text
+
+        Returns:
+            list: Every sentence that was completed by this piece of text, in order
+        """
+        self.buffer += text
+        sentences = []
+        while True:
+            match = SENTENCE_END.search(self.buffer)
+            if match is None:
+                break
+            sentence = self.buffer[:match.end()].strip()
+            self.buffer = self.buffer[match.end():]
+            if sentence:
+                sentences.append(sentence)
+        return sentences
+
+    def flush(self) -> str:
+        """Returns whatever is left in the buffer (the final sentence usually has no trailing whitespace) and empties it."""
+        remaining = self.buffer.strip()
+        self.buffer = ""
+        return remaining
+
+
+def split_sentences(text: str) -> List[str]:
+    """Splits a block of text into its sentences."""
+    buffer = SentenceBuffer()
+    sentences = buffer.feed(text)
+    remaining = buffer.flush()
+    if remaining:
+        sentences.append(remaining)
+    return sentences
+
+
+def sentence_spans(text: str) -> List[Tuple[int, int]]:
+    """
+    Finds where every sentence sits in a block of text.
+
+    Returns:
+        list: A (start, end) character range for each sentence, with surrounding whitespace excluded
+    """
+    spans = []
+    position = 0
+    for match in SENTENCE_END.finditer(text):
+        spans.append((position, match.end()))
+        position = match.end()
+    spans.append((position, len(text)))
+
+    # Trim the whitespace from both ends of each range and drop empty ones
+    trimmed = []
+    for start, end in spans:
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if start < end:
+            trimmed.append((start, end))
+    return trimmed
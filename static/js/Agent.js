@@ -1,7 +1,3 @@
-import Letterize from "https://cdn.skypack.dev/letterizejs@2.0.0";
-import anime from "https://cdn.skypack.dev/animejs@3.2.1";
-
-
 const audioContext = new (window.AudioContext || window.webkitAudioContext)();
 const head = document.querySelector('.agent-head');
 // get the body
@@ -19,8 +15,8 @@ const agents = [
 let audioSource = null;
 let analyser = null;
 let animationId = null;
-let audioBuffer = null;
 let isPlaying = false;
+let socket = null;
 
 
 async function sleep(ms) {
@@ -33,17 +29,6 @@ function setupAnalyser() {
     analyser.smoothingTimeConstant = 0.8;
 }
 
-async function loadAudio(audioFile) {
-    try {
-        const response = await fetch(audioFile); // Replace with your audio file path
-        const arrayBuffer = await response.arrayBuffer();
-        return await audioContext.decodeAudioData(arrayBuffer);
-    } catch (error) {
-        console.error('Error loading audio:', error);
-    }
-}
-
-
 function visualize() {
     const dataArray = new Uint8Array(analyser.frequencyBinCount);
     analyser.getByteFrequencyData(dataArray);
@@ -63,48 +48,102 @@ function visualize() {
     animationId = requestAnimationFrame(visualize);
 }
 
-async function runAudio(id, audioFile) {
-    let agent_id = id;
-    // get a random number between 1 and 3
-    let random = Math.floor(Math.random() * 2);
+// Pipelined turns send one clip per sentence, so clips are queued and played back to back
+const audioQueue = [];
+let hideTimeout = null;
+
+function queueAudio(id, audioFile, turnId) {
+    // An audio element starts downloading straight away and can play while the server is still streaming the clip,
+    // so there's no need to wait for the whole file and decode it first
+    const element = new Audio(audioFile);
+    element.preload = 'auto';
+    audioQueue.push({ id: id, element: element, turnId: turnId });
+    if (!isPlaying) {
+        playNextAudio();
+    }
+}
+
+function playNextAudio() {
+    if (audioQueue.length === 0) {
+        return;
+    }
+    isPlaying = true;
+    clearTimeout(hideTimeout);
+    const next = audioQueue.shift();
+    let agent_id = next.id;
 
     // get the agent head and body
     headImage.src = agents[agent_id][0].head;
     bodyImage.src = agents[agent_id][0].body;
-    // activate the model
-    audioBuffer = await loadAudio(audioFile);
     // get the model head
     $("#agent-container").animate({ top: '0px' }, 500);
-    setupAnalyser();
-    audioSource = audioContext.createBufferSource();
-    audioSource.buffer = audioBuffer;
+    if (!analyser) {
+        setupAnalyser();
+        analyser.connect(audioContext.destination);
+    }
+    audioSource = audioContext.createMediaElementSource(next.element);
     audioSource.connect(analyser);
-    analyser.connect(audioContext.destination);
-
-    // Start audio playback
-    audioSource.start(0);
-    isPlaying = true;
-    // Start visualization
-    visualize();
-
 
     // check when audio is done playing
-    audioSource.onended = function () {
-        // turn model opacity to 0
-
-        $("#agent-container").animate({ top: '100vh' }, 500);
-        head.style.transform = `rotate(0deg)`;
-        body.style.transform = `rotate(0deg)`;
+    next.element.onended = function () {
+        next.element.onerror = null;
         isPlaying = false;
+        audioDone(next.turnId);
+        audioSource.disconnect();
         cancelAnimationFrame(animationId);
+        if (audioQueue.length > 0) {
+            playNextAudio();
+            return;
+        }
+        // Give the next sentence a moment to arrive before hiding the model
+        hideTimeout = setTimeout(function () {
+            if (isPlaying) {
+                return;
+            }
+            $("#agent-container").animate({ top: '100vh' }, 500);
+            head.style.transform = `rotate(0deg)`;
+            body.style.transform = `rotate(0deg)`;
+        }, 300);
     };
+    next.element.onerror = function () {
+        next.element.onended = null;
+        next.element.onerror = null;
+        console.error('Error loading audio:', next.element.error);
+        isPlaying = false;
+        audioDone(next.turnId);
+        audioSource.disconnect();
+        playNextAudio();
+    };
+
+    // Start audio playback
+    next.element.play().catch(function () {
+        // e.g. the clip couldn't be loaded before play() was called
+        if (next.element.onerror)
+            next.element.onerror();
+    });
+    // Start visualization
+    cancelAnimationFrame(animationId);
+    visualize();
 }
 
 
 
+// Lets the server know the clip has finished playing, so the next one can start
+function audioDone(turnId) {
+    if (socket && turnId)
+        socket.emit('agent_done', { turn_id: turnId });
+}
+
 $(document).ready(function () {
 
-    var socket = io();
+    socket = io({ transports: window.SOCKET_TRANSPORTS || ['websocket'] });
+
+    // agent.html?agent=2 only gets agent 2's events, without it the overlay gets every agent's.
+    // Rooms are lost on reconnect, so join again every time
+    const agentParam = new URLSearchParams(window.location.search).get('agent');
+    socket.on('connect', function () {
+        socket.emit('join_agent', agentParam ? { agent_id: parseInt(agentParam) } : {});
+    });
 
     socket.on('start_agent', function (msg, cb) {
         console.log("Got data: " + msg)
@@ -117,8 +156,8 @@ $(document).ready(function () {
             cb();
     });
 
-    // Updates each sentence
-    socket.on('agent_audio', function (msg, cb) {
+    // The audio for a turn (or a sentence of a pipelined turn). Subtitles are timed by the overlay that shows them
+    socket.on('agent_turn', function (msg, cb) {
         console.log("Got data: " + msg)
 
         var agent_id = msg.agent_id - 1;
@@ -127,7 +166,7 @@ $(document).ready(function () {
             agent_id = 0;
         }
 
-        runAudio(agent_id, agent_audio);
+        queueAudio(agent_id, agent_audio, msg.turn_id);
 
         if (cb)
             cb();
@@ -1,9 +1,87 @@
-import Letterize from "https://cdn.skypack.dev/letterizejs@2.0.0";
-import anime from "https://cdn.skypack.dev/animejs@3.2.1";
+import { SubtitleRenderer } from "./subtitleRenderer.js";
+
+// The turn each agent is showing right now
+const activeTurns = {};
+
+// One renderer per agent's text box, so the letter spans get reused from sentence to sentence
+const renderers = {};
+
+function subtitleRenderer(agentId) {
+    if (!renderers[agentId])
+        renderers[agentId] = new SubtitleRenderer(document.getElementById("agent-text-" + agentId));
+    return renderers[agentId];
+}
+
+function showSubtitle(agentId, text) {
+    subtitleRenderer(agentId).show(text);
+}
+
+// Only the overlay that actually plays the audio (agent.html) acknowledges turns with agent_done. This page runs on a muted copy
+// of the audio, which can finish while agent.html is still playing an earlier clip, so its ack would let the next agent talk over it
+function startTurn(msg) {
+    stopTurn(msg.agent_id);
+
+    // A muted copy of the agent's audio, used as the clock for the subtitles so they follow the actual playback
+    const audio = new Audio(msg.audio);
+    audio.muted = true;
+    const turn = { audio: audio, sentence: -1, frame: null, startedAt: performance.now(), audioFailed: false, done: false };
+    activeTurns[msg.agent_id] = turn;
+
+    function currentTime() {
+        // If the audio can't be played here, go by the time since the turn arrived instead
+        return turn.audioFailed ? (performance.now() - turn.startedAt) / 1000 : audio.currentTime;
+    }
+
+    function finish() {
+        if (turn.done)
+            return;
+        turn.done = true;
+        cancelAnimationFrame(turn.frame);
+    }
+
+    function tick() {
+        const time = currentTime();
+        // Show the last sentence that has started
+        let sentence = turn.sentence;
+        while (sentence + 1 < msg.schedule.length && msg.schedule[sentence + 1].start_time <= time)
+            sentence++;
+        if (sentence !== turn.sentence) {
+            turn.sentence = sentence;
+            showSubtitle(msg.agent_id, msg.schedule[sentence].text);
+        }
+        const lastSentence = msg.schedule[msg.schedule.length - 1];
+        if (turn.audioFailed && lastSentence && lastSentence.end_time != null && time >= lastSentence.end_time) {
+            finish();
+            return;
+        }
+        turn.frame = requestAnimationFrame(tick);
+    }
+
+    audio.addEventListener('ended', finish);
+    audio.addEventListener('error', function() { turn.audioFailed = true; });
+    audio.play().catch(function() { turn.audioFailed = true; });
+    tick();
+}
+
+function stopTurn(agentId) {
+    const turn = activeTurns[agentId];
+    if (!turn)
+        return;
+    turn.done = true;
+    cancelAnimationFrame(turn.frame);
+    turn.audio.pause();
+    turn.audio.removeAttribute('src');
+    delete activeTurns[agentId];
+}
 
 $(document).ready(function() {
 
-    var socket = io();
+    var socket = io({ transports: window.SOCKET_TRANSPORTS || ['websocket'] });
+
+    // The main page shows every agent, so it joins all of their rooms (again on every reconnect, rooms don't survive it)
+    socket.on('connect', function() {
+        socket.emit('join_agent', {});
+    });
 
     socket.on('start_agent', function(msg, cb) {
         console.log("Got data: " + msg)
@@ -14,41 +92,9 @@ $(document).ready(function() {
             cb();
     });
 
-    // Updates each sentence
-    socket.on('agent_message', function(msg, cb) {
-        
-        $("#agent-text-" + msg.agent_id).text(msg.text)
-        
-        // Note that openAiAnimation is NOT a const variable
-        let openAiAnimation = new Letterize({targets: "#agent-text-" + msg.agent_id, className: "agent-letter"});
-
-        // Now we've turned every letter into its own span, we group all of the letter spans into "word" elements, so that the word elements can wrap around multiple lines appropriately
-        let $openaiText = $('#agent-text-' + msg.agent_id); // Get the openai-text container
-        let $letters = $openaiText.find('.agent-letter'); // Get all the letter spans inside the openai_text container
-        let $newContent = $('<div></div>'); // Create a new jQuery object to hold the new structure
-        let $wordSpan = $('<span class="agent-word"></span>'); // Create a new word span to start with
-        // Iterate over each letter span to create the word element
-        $letters.each(function() {
-            const $letter = $(this);
-            if ($letter.text().trim() === '') { // Check if the letter is a space
-                $newContent.append($wordSpan); // Append the current word span to the new content
-                $newContent.append($letter); // Add the space directly to the new content
-                $wordSpan = $('<span class="agent-word"></span>'); // Create a new word span for the next word
-            } else {
-                $wordSpan.append($letter); // If not a space, append the letter to the current word span
-            }
-        });
-        $newContent.append($wordSpan); // Append the last word span to the new content
-        $openaiText.empty().append($newContent.contents()); // Clear the openai_text container and append the new content
-
-        var animation = anime.timeline({
-            targets: openAiAnimation.listAll,
-            delay: anime.stagger(30),
-            loop: true
-        });
-        animation
-            .add({translateY: -2, duration: 1000})
-            .add({translateY: 0, duration: 1000});
+    // The whole turn arrives at once: the audio and when each sentence starts and ends in it
+    socket.on('agent_turn', function(msg, cb) {
+        startTurn(msg);
 
         if (cb)
             cb();
@@ -57,7 +103,11 @@ $(document).ready(function() {
     socket.on('clear_agent', function (msg, cb) {
         console.log("Client received clear message instruction!")
 
-        $('#agent-container-' + msg.agent_id).animate({ opacity: 0 }, 500);
+        stopTurn(msg.agent_id);
+        // Once the text has faded out, remove it so its animations don't keep running while hidden
+        $('#agent-container-' + msg.agent_id).animate({ opacity: 0 }, 500, function() {
+            subtitleRenderer(msg.agent_id).clear();
+        });
 
         if (cb)
             cb();
@@ -0,0 +1,107 @@
+import { SubtitleRenderer } from "./subtitleRenderer.js";
+
+// Shows a lot of sentences in a row (one every few frames) and measures the frame times while doing it.
+// ?renderer=legacy measures the old rendering (Letterize spans rebuilt with jQuery, a new looping anime.js timeline per sentence)
+const params = new URLSearchParams(window.location.search);
+const SENTENCES = parseInt(params.get('sentences') || '1000');
+const FRAMES_PER_SENTENCE = parseInt(params.get('frames') || '3');
+const RENDERER = params.get('renderer') || 'pooled';
+
+const WORDS = ["chaos", "goblin", "spreadsheet", "volcano", "chat", "definitely", "banana", "tax", "wizard", "extremely", "why", "the", "is", "a", "my", "legally"];
+
+function makeSentence(index) {
+    const length = 6 + (index % 12);
+    const words = [];
+    for (let i = 0; i < length; i++)
+        words.push(WORDS[(index * 7 + i * 3) % WORDS.length]);
+    return words.join(' ') + (index % 3 === 0 ? '?' : '.');
+}
+
+async function legacyRenderer() {
+    const { default: Letterize } = await import("https://cdn.skypack.dev/letterizejs@2.0.0");
+    const { default: anime } = await import("https://cdn.skypack.dev/animejs@3.2.1");
+    // Turns off the CSS bob that .agent-letter has now, so only the old anime.js animation gets measured
+    document.getElementById('agent-text-1').classList.add('legacy-renderer');
+    return {
+        show(text) {
+            $("#agent-text-1").text(text);
+            let openAiAnimation = new Letterize({targets: "#agent-text-1", className: "agent-letter"});
+            let $openaiText = $('#agent-text-1');
+            let $letters = $openaiText.find('.agent-letter');
+            let $newContent = $('<div></div>');
+            let $wordSpan = $('<span class="agent-word"></span>');
+            $letters.each(function() {
+                const $letter = $(this);
+                if ($letter.text().trim() === '') {
+                    $newContent.append($wordSpan);
+                    $newContent.append($letter);
+                    $wordSpan = $('<span class="agent-word"></span>');
+                } else {
+                    $wordSpan.append($letter);
+                }
+            });
+            $newContent.append($wordSpan);
+            $openaiText.empty().append($newContent.contents());
+            anime.timeline({targets: openAiAnimation.listAll, delay: anime.stagger(30), loop: true})
+                .add({translateY: -2, duration: 1000})
+                .add({translateY: 0, duration: 1000});
+        }
+    };
+}
+
+function percentile(sorted, fraction) {
+    return sorted[Math.min(sorted.length - 1, Math.floor(sorted.length * fraction))];
+}
+
+async function run() {
+    const renderer = RENDERER === 'legacy' ? await legacyRenderer() : new SubtitleRenderer(document.getElementById('agent-text-1'));
+    const frameTimes = [];
+    const renderTimes = [];
+    let sentence = 0;
+    let frame = 0;
+    let lastFrame = null;
+
+    function tick(now) {
+        if (lastFrame !== null)
+            frameTimes.push(now - lastFrame);
+        lastFrame = now;
+
+        if (frame % FRAMES_PER_SENTENCE === 0) {
+            if (sentence >= SENTENCES) {
+                report();
+                return;
+            }
+            const start = performance.now();
+            renderer.show(makeSentence(sentence));
+            renderTimes.push(performance.now() - start);
+            sentence++;
+        }
+        frame++;
+        requestAnimationFrame(tick);
+    }
+
+    function report() {
+        const sorted = frameTimes.slice().sort((a, b) => a - b);
+        const mean = frameTimes.reduce((total, time) => total + time, 0) / frameTimes.length;
+        const renderMean = renderTimes.reduce((total, time) => total + time, 0) / renderTimes.length;
+        const results = {
+            renderer: RENDERER,
+            sentences: SENTENCES,
+            frames: frameTimes.length,
+            frame_mean_ms: +mean.toFixed(2),
+            frame_p95_ms: +percentile(sorted, 0.95).toFixed(2),
+            frame_p99_ms: +percentile(sorted, 0.99).toFixed(2),
+            frame_max_ms: +sorted[sorted.length - 1].toFixed(2),
+            frames_over_33ms: frameTimes.filter(time => time > 33.4).length,
+            render_mean_ms: +renderMean.toFixed(3),
+        };
+        document.getElementById('bench-results').textContent = JSON.stringify(results, null, 2);
+        console.log(results);
+        // Lets automated runs pick up the results
+        window.benchResults = results;
+    }
+
+    requestAnimationFrame(tick);
+}
+
+run();
@@ -0,0 +1,77 @@
+// Renders a subtitle as word and letter spans, with every letter bobbing up and down.
+// The bob is a CSS animation (see .agent-letter in style.css), so there's no animation library running per letter,
+// and the spans are kept in a pool and reused for the next sentence instead of being rebuilt each time.
+// Showing a new sentence detaches the old spans, which also stops their animations.
+
+// Delay between neighbouring letters starting their bob, in ms
+const LETTER_STAGGER = 30;
+// Don't keep more than this many spare spans around between sentences
+const MAX_POOL_SIZE = 1000;
+
+export class SubtitleRenderer {
+    constructor(container) {
+        this.container = container;
+        this.letterPool = [];
+        this.wordPool = [];
+        this.usedLetters = [];
+        this.usedWords = [];
+    }
+
+    show(text) {
+        this.clear();
+        const fragment = document.createDocumentFragment();
+        let letterIndex = 0;
+        let word = null;
+        for (const character of text) {
+            if (character.trim() === '') {
+                // Spaces sit between the words, so the words can wrap onto the next line
+                if (word) {
+                    fragment.appendChild(word);
+                    word = null;
+                }
+                fragment.appendChild(this.letter(' ', letterIndex++, 'agent-space'));
+                continue;
+            }
+            if (!word)
+                word = this.word();
+            word.appendChild(this.letter(character, letterIndex++, 'agent-letter'));
+        }
+        if (word)
+            fragment.appendChild(word);
+        this.container.appendChild(fragment);
+    }
+
+    // Removes the current sentence (stopping its animations) and puts its spans back in the pool
+    clear() {
+        this.container.textContent = '';
+        for (const word of this.usedWords) {
+            // Detaches the word's letters too
+            word.textContent = '';
+            if (this.wordPool.length < MAX_POOL_SIZE)
+                this.wordPool.push(word);
+        }
+        for (const letter of this.usedLetters) {
+            if (this.letterPool.length >= MAX_POOL_SIZE)
+                break;
+            this.letterPool.push(letter);
+        }
+        this.usedLetters = [];
+        this.usedWords = [];
+    }
+
+    letter(character, index, className) {
+        const letter = this.letterPool.pop() || document.createElement('span');
+        letter.className = className;
+        letter.textContent = character;
+        letter.style.animationDelay = (index * LETTER_STAGGER) + 'ms';
+        this.usedLetters.push(letter);
+        return letter;
+    }
+
+    word() {
+        const word = this.wordPool.pop() || document.createElement('span');
+        word.className = 'agent-word';
+        this.usedWords.push(word);
+        return word;
+    }
+}
@@ -0,0 +1,98 @@
+from typing import Callable, Dict, List, Optional, Union
+
+from sentences import sentence_spans
+
+# Roughly how long a TTS voice pauses between two sentences, used when we only know the total audio length
+SENTENCE_PAUSE_SECONDS = 0.3
+# Never spend more than this share of the clip on pauses, so very short clips still get readable subtitles
+MAX_PAUSE_SHARE = 0.2
+
+
+def timestamps_from_alignment(alignment: Dict[str, list]) -> List[Dict[str, Union[str, float]]]:
+    """
+    Builds sentence timestamps from TTS character alignment data.
+
+    Args:
+        alignment (dict): ElevenLabs alignment data, with 'characters', 'character_start_times_seconds'
+            and 'character_end_times_seconds' lists that all have one entry per character
+
+    Returns:
+        list: One {'text', 'start_time', 'end_time'} dictionary per sentence
+    """
+    characters = alignment['characters']
+    start_times = alignment['character_start_times_seconds']
+    end_times = alignment['character_end_times_seconds']
+    text = "".join(characters)
+
+    timestamps = []
+    for start, end in sentence_spans(text):
+        timestamps.append({
+            'text': text[start:end],
+            'start_time': start_times[start],
+            'end_time': end_times[end - 1]
+        })
+    return timestamps
+
+
+def timestamps_from_duration(text: str, duration: float) -> List[Dict[str, Union[str, float]]]:
+    """
+    Estimates sentence timestamps by splitting the known text across the length of the audio.
+    Every sentence gets speaking time in proportion to its number of characters, with a short pause in between.
+
+    Args:
+        text (str): The exact text that was sent to TTS
+        duration (float): Length of the generated audio in seconds
+
+    Returns:
+        list: One {'text', 'start_time', 'end_time'} dictionary per sentence
+    """
+    spans = sentence_spans(text)
+    if not spans:
+        return []
+
+    pause = 0.0
+    if len(spans) > 1:
+        pause = min(SENTENCE_PAUSE_SECONDS, duration * MAX_PAUSE_SHARE / (len(spans) - 1))
+    speaking_time = duration - pause * (len(spans) - 1)
+    total_characters = sum(end - start for start, end in spans)
+
+    timestamps = []
+    current_time = 0.0
+    for start, end in spans:
+        sentence_time = speaking_time * (end - start) / total_characters
+        timestamps.append({
+            'text': text[start:end],
+            'start_time': round(current_time, 3),
+            'end_time': round(current_time + sentence_time, 3)
+        })
+        current_time += sentence_time + pause
+    return timestamps
+
+
+def sentence_timestamps(text: str, duration: Optional[Union[float, Callable[[], float]]] = None, alignment: Optional[Dict[str, list]] = None) -> List[Dict[str, Union[str, float]]]:
+    """
+    Works out when each sentence of a TTS clip is spoken, without running speech recognition on the audio.
+    Uses the TTS character alignment when it's available, otherwise splits the text across the audio duration.
+
+    Args:
+        text (str): The exact text that was sent to TTS
+        duration (float or function, optional): Length of the generated audio in seconds, or a function that measures it.
+            A function is only called if the alignment can't be used
+        alignment (dict, optional): Character alignment data returned by the TTS service
+
+    Returns:
+        list: One {'text', 'start_time', 'end_time'} dictionary per sentence, the same format as WhisperManager.audio_to_text(..., "sentence")
+    """
+    if alignment:
+        try:
+            timestamps = timestamps_from_alignment(alignment)
+            if timestamps:
+                return timestamps
+        except (KeyError, IndexError, TypeError):
+            # Malformed alignment data, fall back to the duration estimate
+            pass
+    if callable(duration):
+        duration = duration()
+    if duration is None:
+        raise ValueError("sentence_timestamps needs either alignment data or the audio duration")
+    return timestamps_from_duration(text, duration)
@@ -0,0 +1,96 @@
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+from eleven_labs import ElevenLabsManager
+from elevenlabs_stand_in import ElevenLabsStandIn
+from tts_cache import TTSCache
+from voice_catalog import VoiceCatalog
+
+
+def unused_url():
+    # A port nothing listens on, to stand in for "the API can't be reached"
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}"
+
+
+class ElevenLabsManagerTest(unittest.TestCase):
+    """Runs ElevenLabsManager against the local Elevenlabs stand-in, so no API key or network is needed"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.catalog_path = os.path.join(self.temp_dir, "voice_catalog.json")
+        self.caches = []
+        self.stand_in = ElevenLabsStandIn({"Eldrin ": {"stability": 0.3, "similarity_boost": 0.8}}).start()
+
+    def tearDown(self):
+        self.stand_in.stop()
+        for cache in self.caches:
+            cache.flush()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def manager(self, base_url=None, ttl=3600):
+        cache = TTSCache(directory=os.path.join(self.temp_dir, "tts_cache"))
+        self.caches.append(cache)
+        return ElevenLabsManager(tts_cache=cache, voice_catalog=VoiceCatalog(self.catalog_path, ttl=ttl), base_url=base_url or self.stand_in.base_url)
+
+    def test_first_start_fetches_the_catalog(self):
+        manager = self.manager()
+        self.assertIn("Eldrin ", manager.voice_to_id)
+        self.assertEqual(manager.get_voice_settings("Eldrin ").stability, 0.3)
+        self.assertTrue(os.path.exists(self.catalog_path))
+
+    def test_cached_catalog_works_offline(self):
+        self.manager().prefetch_voices(["Eldrin "])
+        # A stale catalog tries a background refresh, which fails and leaves the cached catalog in use
+        offline = self.manager(base_url=unused_url(), ttl=0)
+        self.assertEqual(offline.get_voice_id("Eldrin "), self.stand_in.voices["Eldrin "]["voice_id"])
+        self.assertEqual(offline.get_voice_settings("Eldrin ").similarity_boost, 0.8)
+
+    def test_fresh_catalog_makes_no_api_calls(self):
+        self.manager().prefetch_voices(["Eldrin "])
+        self.stand_in.requests.clear()
+        self.manager().get_voice_settings("Eldrin ")
+        self.assertEqual(self.stand_in.requests, [])
+
+    def test_new_voice_refreshes_the_catalog(self):
+        manager = self.manager()
+        voice_id = self.stand_in.add_voice("Brand New Voice")
+        self.assertEqual(manager.get_voice_id("Brand New Voice"), voice_id)
+
+    def test_unknown_voice_raises_a_clear_error(self):
+        manager = self.manager()
+        with self.assertRaisesRegex(ValueError, "no voice named 'Nobody'"):
+            manager.get_voice_id("Nobody")
+
+    def test_refresh_replaces_loaded_settings(self):
+        manager = self.manager()
+        manager.get_voice_settings("Eldrin ")
+        self.stand_in.add_voice("Eldrin ", {"stability": 0.9, "similarity_boost": 0.1})
+        manager.refresh_voices()
+        self.assertEqual(manager.get_voice_settings("Eldrin ").stability, 0.9)
+
+    def test_text_to_audio_is_cached(self):
+        manager = self.manager()
+        tts_file = manager.text_to_audio("Hello chat!", "Eldrin ", False)
+        with open(tts_file, "rb") as file:
+            self.assertEqual(file.read(), b"ID3Hello chat!")
+        self.stand_in.requests.clear()
+        self.assertEqual(manager.text_to_audio("Hello chat!", "Eldrin ", False), tts_file)
+        self.assertEqual(self.stand_in.requests, [])
+
+    def test_text_to_audio_with_timestamps(self):
+        tts_file, alignment = self.manager().text_to_audio_with_timestamps("Hi.", "Eldrin ", False)
+        self.assertTrue(os.path.exists(tts_file))
+        self.assertEqual(alignment["characters"], ["H", "i", "."])
+
+    def test_text_to_audio_stream(self):
+        chunks = list(self.manager().text_to_audio_stream("Streaming!", "Eldrin ", persist=False))
+        self.assertEqual(b"".join(chunks), b"ID3Streaming!")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+from typing import Callable, Dict, Tuple
+
+# Every chat message costs a few template tokens on top of its text (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# English text averages roughly 4 characters per token for the Llama/Qwen style tokenizers Ollama models use
+CHARACTERS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate for models we don't have a local tokenizer for"""
+    return (len(text) + CHARACTERS_PER_TOKEN - 1) // CHARACTERS_PER_TOKEN
+
+
+class MessageTokenCache:
+    """
+    Remembers the token count of every chat message, so each message is only tokenized once
+    no matter how many times the history is sent.
+    Messages are keyed by identity, and the cache keeps a reference to each message so its id can't be reused.
+    """
+
+    def __init__(self, count_tokens: Callable[[dict], int]):
+        """
+        Args:
+            count_tokens (callable): Function that returns the token count of one message
+        """
+        self.count_tokens = count_tokens
+        self._counts: Dict[int, Tuple[dict, int]] = {}
+
+    def count(self, message: dict) -> int:
+        """Returns the token count of a message, counting it only the first time it's seen"""
+        cached = self._counts.get(id(message))
+        if cached is None:
+            cached = (message, self.count_tokens(message))
+            self._counts[id(message)] = cached
+        return cached[1]
+
+    def forget(self, message: dict):
+        """Drop a message that has left the history"""
+        self._counts.pop(id(message), None)
+
+    def __len__(self):
+        return len(self._counts)
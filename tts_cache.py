@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+from atomic_file import write_atomic
+
+
+class TTSCache:
+    """
+    Persistent, content-addressed cache of generated TTS audio.
+
+    Clips are keyed by a stable hash of everything that affects the audio (text, voice, model and voice settings),
+    so a line the agents have said before is played from disk without another API call.
+    The index (index.json in the cache directory) keeps the entries in least-recently-used order, and the oldest
+    clips are deleted once the cache grows past max_bytes. Clips that are pinned (being played) are never deleted.
+    Cache hits only reorder the index in memory, it's written to disk on the next put and at exit.
+    The cache lives under static/ so the overlay can fetch cached clips directly.
+    """
+
+    def __init__(self, directory=os.path.join("static", "tts_cache"), max_bytes=200 * 1024 * 1024):
+        """
+        Args:
+            directory (str, optional): Folder that holds the cached clips and their index
+            max_bytes (int, optional): Total size the cached clips may take up before the least recently used ones are evicted
+        """
+        self.directory = os.path.join(os.path.abspath(os.curdir), directory)
+        self.index_path = os.path.join(self.directory, "index.json")
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.entries = OrderedDict()
+        # Index changes that haven't been written yet
+        self._dirty = False
+        # Pin counts by file name
+        self._pinned = {}
+        os.makedirs(self.directory, exist_ok=True)
+
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, 'r') as file:
+                    self.entries = OrderedDict(json.load(file))
+            except ValueError:
+                # A broken index just means an empty cache, the clips get regenerated
+                self.entries = OrderedDict()
+        self.total_bytes = sum(entry["size"] for entry in self.entries.values())
+
+    @staticmethod
+    def make_key(text: str, voice_id: str, model_id: str, voice_settings: Optional[dict] = None, extension: str = ".mp3") -> str:
+        """Returns the stable cache key for a clip. Unlike hash(), this is the same in every process"""
+        key_data = json.dumps([text, voice_id, model_id, voice_settings, extension], sort_keys=True, default=str)
+        return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[str, Optional[dict]]]:
+        """
+        Look up a clip.
+
+        Returns:
+            tuple: The clip's file path and its character alignment (or None), or None if the clip isn't cached
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            file_path = os.path.join(self.directory, entry["file"])
+            if not os.path.exists(file_path):
+                # Deleted from outside, forget it
+                self._remove(key)
+                self._dirty = True
+                return None
+            self.entries.move_to_end(key)
+            self._dirty = True
+            return file_path, entry.get("alignment")
+
+    def put(self, key: str, audio: bytes, extension: str = ".mp3", alignment: Optional[dict] = None) -> str:
+        """
+        Store a clip, evicting the least recently used clips if the cache is full.
+
+        Returns:
+            str: The path of the cached clip
+        """
+        file_name = f"{key}{extension}"
+        file_path = os.path.join(self.directory, file_name)
+        with self._lock:
+            with open(file_path, "wb") as file:
+                file.write(audio)
+            if key in self.entries:
+                self._remove(key, delete_file=False)
+            self.entries[key] = {"file": file_name, "size": len(audio), "alignment": alignment}
+            self.total_bytes += len(audio)
+
+            # Never evict the clip we just stored (it's about to be played) or one that's playing right now
+            for old_key in list(self.entries):
+                if self.total_bytes <= self.max_bytes:
+                    break
+                if old_key != key and self.entries[old_key]["file"] not in self._pinned:
+                    self._remove(old_key)
+            self._save_index()
+        return file_path
+
+    def flush(self):
+        """Write the index if cache hits have changed it since the last write. Call this before the app exits"""
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    @contextmanager
+    def pinned(self, file_path: str):
+        """Keeps a clip from being evicted while the with block runs, e.g. while the overlay plays it"""
+        file_name = os.path.basename(file_path)
+        with self._lock:
+            self._pinned[file_name] = self._pinned.get(file_name, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pinned[file_name] -= 1
+                if not self._pinned[file_name]:
+                    del self._pinned[file_name]
+
+    def _remove(self, key: str, delete_file: bool = True):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry["size"]
+        if delete_file:
+            try:
+                os.remove(os.path.join(self.directory, entry["file"]))
+            except OSError:
+                pass
+
+    def _save_index(self):
+        write_atomic(self.index_path, json.dumps(self.entries))
+        self._dirty = False
@@ -0,0 +1,303 @@
+import heapq
+import itertools
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from rich import print
+
+
+class Turn:
+    """
+    One agent turn moving through the pipeline.
+
+    A turn only gets its place in the playback order (seq) when it's committed. Until then its finished sentences
+    are held back, which is what lets a speculative draft be synthesized ahead of time and still be thrown away.
+    """
+
+    def __init__(self, agent):
+        self.agent = agent
+        self.seq: Optional[int] = None
+        self.sentences: List[str] = []
+        self.cancelled = False
+        self.generated = threading.Event() # All sentences are known
+        self.finished = threading.Event() # Playback is done (or the turn was cancelled)
+        self._held: List["SentenceItem"] = []
+        self._lock = threading.Lock()
+
+
+class SentenceItem:
+    """A sentence of a turn on its way through TTS, alignment and playback. The item with is_end set marks the end of the turn"""
+
+    __slots__ = ("turn", "index", "text", "audio", "duration", "error", "is_end")
+
+    def __init__(self, turn: Turn, index: int, text: Optional[str] = None, is_end: bool = False):
+        self.turn = turn
+        self.index = index
+        self.text = text
+        self.audio = None # Whatever the synthesize callback produced, e.g. a file path or an AudioStream
+        self.duration: Optional[float] = None
+        self.error: Optional[Exception] = None
+        self.is_end = is_end
+
+
+class Stage:
+    """
+    A pipeline stage: a bounded input queue with its own pool of worker threads.
+    Putting into a full queue blocks, so a slow stage holds back the stages before it instead of piling up work.
+    """
+
+    def __init__(self, name: str, handler: Callable, workers: int = 1, queue_size: int = 16,
+                 on_idle: Optional[Callable[[], None]] = None, idle_interval: float = 1.0):
+        """
+        Args:
+            on_idle (function, optional): Called by a worker whenever its queue stays empty for idle_interval seconds
+        """
+        self.name = name
+        self.handler = handler
+        self.on_idle = on_idle
+        self.idle_interval = idle_interval
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.busy = 0
+        self.processed = 0
+        self.max_queued = 0
+        self.service_seconds = 0.0
+        # Time producers spent waiting for room in this stage's queue (backpressure)
+        self.blocked_seconds = 0.0
+        self._lock = threading.Lock()
+        for worker_number in range(workers):
+            worker = threading.Thread(target=self._work, name=f"{name}-{worker_number+1}")
+            worker.daemon = True
+            worker.start()
+
+    def put(self, item):
+        start_time = time.perf_counter()
+        self.queue.put(item)
+        waited = time.perf_counter() - start_time
+        with self._lock:
+            self.blocked_seconds += waited
+            self.max_queued = max(self.max_queued, self.queue.qsize())
+
+    def _work(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.idle_interval if self.on_idle else None)
+            except queue.Empty:
+                try:
+                    self.on_idle()
+                except Exception as e:
+                    print(f"[red]Error in the {self.name} stage: {str(e)}")
+                continue
+            with self._lock:
+                self.busy += 1
+            start_time = time.perf_counter()
+            try:
+                self.handler(item)
+            except Exception as e:
+                print(f"[red]Error in the {self.name} stage: {str(e)}")
+            finally:
+                with self._lock:
+                    self.busy -= 1
+                    self.processed += 1
+                    self.service_seconds += time.perf_counter() - start_time
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "busy": self.busy,
+                "queued": self.queue.qsize(),
+                "max_queued": self.max_queued,
+                "capacity": self.queue.maxsize,
+                "processed": self.processed,
+                "avg_ms": round(1000 * self.service_seconds / self.processed, 1) if self.processed else None,
+                "blocked_seconds": round(self.blocked_seconds, 3),
+            }
+
+
+class TurnPipeline:
+    """
+    Runs agent turns as LLM -> TTS -> align -> playback, with a bounded queue and a worker pool per stage.
+
+    The LLM stage runs generation jobs one at a time, and the jobs feed each sentence into TTS as soon as it's generated.
+    TTS works on several sentences at once (and from several turns), alignment works out how long each clip is,
+    and playback plays the sentences strictly in order: by turn in commit order, then by sentence.
+    The stages only do the scheduling, the actual work is done by the callbacks.
+    """
+
+    def __init__(self, synthesize: Callable[[SentenceItem, Callable[[], None]], None], align: Callable[[SentenceItem], None],
+                 play: Callable[[SentenceItem], None], start_turn: Callable[[Turn], None], end_turn: Callable[[Turn], None],
+                 tts_workers: int = 3, queue_size: int = 16, stall_timeout: float = 30.0):
+        """
+        Args:
+            synthesize (function): Sets item.audio. Gets a forward() function it can call to send the item on early (e.g. once an audio stream has started),
+                otherwise the item is sent on when synthesize returns
+            align (function): Sets item.duration if it can be worked out before playback
+            play (function): Plays one sentence, returns once it's done
+            start_turn (function): Called before the first sentence of a turn is played
+            end_turn (function): Called after the last sentence of a turn is played
+            tts_workers (int, optional): How many sentences are synthesized at once
+            queue_size (int, optional): Size of each stage's input queue
+            stall_timeout (float, optional): A turn that has started playing, has finished generating and then gets nothing played
+                for this many seconds is ended, so a lost sentence or end marker can't hold up every turn after it
+        """
+        self.synthesize = synthesize
+        self.align = align
+        self.play = play
+        self.start_turn = start_turn
+        self.end_turn = end_turn
+        self._seq_counter = itertools.count()
+        self._commit_lock = threading.Lock()
+        # Playback state, only touched by the single playback worker
+        self._reorder_heap = []
+        self._tie_breaker = itertools.count()
+        self._next_seq = 0
+        self._next_index = 0
+        self._turn_started = False
+        self.stall_timeout = stall_timeout
+        self._last_progress = time.monotonic()
+        self._current_turn: Optional[Turn] = None
+
+        self.llm_stage = Stage("llm", self._run_job, workers=1, queue_size=queue_size)
+        self.tts_stage = Stage("tts", self._synthesize, workers=tts_workers, queue_size=queue_size)
+        self.align_stage = Stage("align", self._align, workers=1, queue_size=queue_size)
+        # Playback drains its queue into the reorder buffer, so it gets more room for sentences that arrive early
+        self.playback_stage = Stage("playback", self._play, workers=1, queue_size=4 * queue_size, on_idle=self._check_stalled)
+
+    def submit(self, job: Callable[[Turn], None], turn: Turn):
+        """Queue a generation job for the LLM stage. The job should call add_sentence for each sentence it generates"""
+        self.llm_stage.put((job, turn))
+
+    def commit(self, turn: Turn):
+        """Give the turn its place in the playback order and release any sentences it already has"""
+        with self._commit_lock:
+            with turn._lock:
+                if turn.seq is not None or turn.cancelled:
+                    return
+                turn.seq = next(self._seq_counter)
+                held = turn._held
+                turn._held = []
+        for item in held:
+            self.playback_stage.put(item)
+
+    def cancel(self, turn: Turn):
+        """Throw away an uncommitted turn (e.g. a stale draft)"""
+        with turn._lock:
+            if turn.seq is not None:
+                return
+            turn.cancelled = True
+            turn._held = []
+        turn.finished.set()
+
+    def add_sentence(self, turn: Turn, text: str):
+        item = SentenceItem(turn, len(turn.sentences), text)
+        turn.sentences.append(text)
+        self.tts_stage.put(item)
+
+    def _run_job(self, job_and_turn):
+        job, turn = job_and_turn
+        try:
+            job(turn)
+        finally:
+            # The end marker goes straight to playback, it's what moves playback on to the next turn
+            self._deliver(SentenceItem(turn, len(turn.sentences), is_end=True))
+            turn.generated.set()
+
+    def _synthesize(self, item: SentenceItem):
+        forwarded = False
+
+        def forward():
+            nonlocal forwarded
+            if not forwarded:
+                forwarded = True
+                self.align_stage.put(item)
+
+        try:
+            self.synthesize(item, forward)
+        except Exception as e:
+            item.error = e
+        forward()
+
+    def _align(self, item: SentenceItem):
+        if item.error is None:
+            try:
+                self.align(item)
+            except Exception as e:
+                item.error = e
+        self._deliver(item)
+
+    def _deliver(self, item: SentenceItem):
+        turn = item.turn
+        with turn._lock:
+            if turn.cancelled:
+                return
+            if turn.seq is None:
+                turn._held.append(item)
+                return
+        self.playback_stage.put(item)
+
+    def _play(self, item: SentenceItem):
+        if item.turn.seq < self._next_seq:
+            # Arrived after its turn was already ended as stalled
+            return
+        heapq.heappush(self._reorder_heap, ((item.turn.seq, item.index), next(self._tie_breaker), item))
+        while self._reorder_heap and self._reorder_heap[0][0] == (self._next_seq, self._next_index):
+            _, _, next_item = heapq.heappop(self._reorder_heap)
+            self._play_in_order(next_item)
+
+    def _play_in_order(self, item: SentenceItem):
+        turn = item.turn
+        self._last_progress = time.monotonic()
+        if item.is_end:
+            self._end_turn(turn)
+            return
+
+        self._next_index += 1
+        # Errors are only reported here, a sentence that fails must not hold up the ones after it
+        try:
+            if not self._turn_started:
+                self._turn_started = True
+                self._current_turn = turn
+                self.start_turn(turn)
+            if item.error is not None:
+                print(f"[magenta] Error synthesizing sentence: {str(item.error)}")
+                return
+            self.play(item)
+        except Exception as e:
+            print(f"[magenta] Error playing sentence: {str(e)}")
+
+    def _end_turn(self, turn: Turn):
+        try:
+            if self._turn_started:
+                self.end_turn(turn)
+        except Exception as e:
+            print(f"[magenta] Error finishing turn: {str(e)}")
+        finally:
+            self._turn_started = False
+            self._current_turn = None
+            self._next_seq += 1
+            self._next_index = 0
+            turn.finished.set()
+
+    def _check_stalled(self):
+        # Runs on the playback worker when its queue has been empty for a while
+        turn = self._current_turn
+        if turn is None or not turn.generated.is_set() or time.monotonic() - self._last_progress < self.stall_timeout:
+            return
+        print(f"[red]Turn {turn.seq} stalled for {self.stall_timeout:.0f} seconds waiting on sentence {self._next_index}, ending it")
+        self._reorder_heap = [entry for entry in self._reorder_heap if entry[0][0] != turn.seq]
+        heapq.heapify(self._reorder_heap)
+        self._end_turn(turn)
+        # The next turn's sentences may already be waiting
+        while self._reorder_heap and self._reorder_heap[0][0] == (self._next_seq, self._next_index):
+            _, _, next_item = heapq.heappop(self._reorder_heap)
+            self._play_in_order(next_item)
+
+    def stats(self) -> Dict:
+        return {
+            "stages": {stage.name: stage.stats() for stage in (self.llm_stage, self.tts_stage, self.align_stage, self.playback_stage)},
+            "playing_turn": self._next_seq,
+            "reorder_buffered": len(self._reorder_heap),
+        }
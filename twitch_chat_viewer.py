@@ -1,32 +1,90 @@
-import socket
+import asyncio
 import threading
 import time
-from dataclasses import dataclass
-from typing import List, Set
+from typing import List, Optional, Set
 import keyboard
 import datetime
 import emoji
 import os
 import sys
 
-@dataclass
-class TwitchMessage:
-    channel: str
-    username: str
-    message: str
-    timestamp: float
+from twitch_log_reader import write_current_log
+from twitch_irc import TwitchMessage, parse_message
+
+class BufferedLogWriter:
+    """
+    Collects log lines in memory and writes them out in batches, instead of a write and flush per chat message.
+    The buffer is written once it holds max_bytes, or once the oldest line has waited max_delay seconds.
+    """
+
+    def __init__(self, file, max_bytes: int = 64 * 1024, max_delay: float = 1.0):
+        self.file = file
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.lines: List[str] = []
+        self.buffered_bytes = 0
+        self.first_line_time = None
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def write(self, line: str):
+        with self._lock:
+            if self.closed:
+                # Logging was switched off while this line was being handled
+                return
+            if not self.lines:
+                self.first_line_time = time.monotonic()
+            self.lines.append(line)
+            self.buffered_bytes += len(line)
+            if self.buffered_bytes >= self.max_bytes:
+                self._flush()
+
+    def flush_if_due(self):
+        """Write the buffer out if the oldest line has waited long enough. Called periodically by the reader"""
+        with self._lock:
+            if self.lines and time.monotonic() - self.first_line_time >= self.max_delay:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self.file.close()
+            self.closed = True
+
+    def _flush(self):
+        if not self.lines:
+            return
+        self.file.write("".join(self.lines))
+        self.file.flush()
+        self.lines = []
+        self.buffered_bytes = 0
 
 class TwitchChatViewer:
-    def __init__(self):
+    def __init__(self, max_logs: int = 20, echo: bool = True):
         self.server = "irc.chat.twitch.tv"
         self.port = 6667
         self.nickname = "justinfan12345"  # Anonymous connection
         self.channels: Set[str] = set()
-        self.socket = socket.socket()
         self.running = False
         self.logging_enabled = False
-        self.log_file = None
-        
+        self.log_file: Optional[BufferedLogWriter] = None
+        self.log_name = None
+        # Only the newest max_logs chat logs are kept, older ones are deleted when a new log is started
+        self.max_logs = max_logs
+        # Print chat to the console
+        self.echo = echo
+        # Reconnect delays double after every failed attempt, up to the max
+        self.min_reconnect_delay = 1.0
+        self.max_reconnect_delay = 60.0
+        # The asyncio loop (on its own thread) owns the connection. Other threads talk to it through _send
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread: Optional[threading.Thread] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
         # Create logs directory if it doesn't exist
         self.logs_dir = "twitch_logs"
         os.makedirs(self.logs_dir, exist_ok=True)
@@ -35,26 +93,55 @@ class TwitchChatViewer:
         self.logging_enabled = not self.logging_enabled
         if self.logging_enabled:
             timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            self.log_file = open(f"{self.logs_dir}/twitch_chat_{timestamp}.log", "a", encoding="utf-8")
+            self.log_name = f"twitch_chat_{timestamp}.log"
+            self.log_file = BufferedLogWriter(open(f"{self.logs_dir}/{self.log_name}", "a", encoding="utf-8"))
+            # Let the agents know which log to read, then clear out old logs
+            write_current_log(self.logs_dir, self.log_name)
+            self._remove_old_logs()
             print("\n[System] Logging enabled - saving to file")
         else:
             if self.log_file:
                 self.log_file.close()
                 self.log_file = None
+                # Keep pointing at the log we just closed, so its chat can still be summarized
+                write_current_log(self.logs_dir, self.log_name, active=False)
             print("\n[System] Logging disabled")
 
-    def connect(self):
-        try:
-            print(f"[System] Connecting to {self.server}...")
-            self.socket.connect((self.server, self.port))
-            self.socket.send(f"NICK {self.nickname}\r\n".encode())
-            time.sleep(1)  # Give some time for the connection to establish
-            self.running = True
-            print("[System] Connected successfully!")
-            return True
-        except Exception as e:
-            print(f"[Error] Failed to connect: {e}")
-            return False
+    def _remove_old_logs(self):
+        # Log names start with their creation time, so sorting by name sorts them oldest first
+        log_names = sorted(name for name in os.listdir(self.logs_dir) if name.endswith(".log"))
+        for log_name in log_names[:max(0, len(log_names) - self.max_logs)]:
+            if log_name == self.log_name:
+                continue
+            try:
+                os.remove(os.path.join(self.logs_dir, log_name))
+            except OSError as e:
+                print(f"[Warning] Couldn't remove old log {log_name}: {e}")
+
+    async def _connect(self):
+        print(f"[System] Connecting to {self.server}...")
+        reader, writer = await asyncio.open_connection(self.server, self.port)
+        self.writer = writer
+        # One connection for every channel, all joined with a single JOIN
+        # Ask for IRCv3 tags, so messages come with badges, ids, emotes and the server's timestamp
+        lines = ["CAP REQ :twitch.tv/tags", f"NICK {self.nickname}"]
+        if self.channels:
+            print(f"[System] Joining channels: {', '.join(sorted(self.channels))}")
+            lines.append(f"JOIN {','.join(sorted(self.channels))}")
+        writer.write("".join(line + "\r\n" for line in lines).encode())
+        await writer.drain()
+        print("[System] Connected successfully!")
+        return reader
+
+    def _send(self, line: str):
+        # Safe to call from any thread, the write happens on the asyncio loop
+        if self.loop is None or self.writer is None:
+            return
+        data = (line + "\r\n").encode()
+        if threading.current_thread() is self.loop_thread:
+            self.writer.write(data)
+        else:
+            self.loop.call_soon_threadsafe(self.writer.write, data)
 
     def join_channel(self, channel: str):
         if not channel.startswith('#'):
@@ -62,8 +149,7 @@ class TwitchChatViewer:
         self.channels.add(channel)
         if self.running:
             print(f"[System] Joining channel: {channel}")
-            self.socket.send(f"JOIN {channel}\r\n".encode())
-            time.sleep(0.5)  # Rate limiting for joins
+            self._send(f"JOIN {channel}")
 
     def leave_channel(self, channel: str):
         if not channel.startswith('#'):
@@ -71,77 +157,93 @@ class TwitchChatViewer:
         if channel in self.channels:
             self.channels.remove(channel)
             if self.running:
-                self.socket.send(f"PART {channel}\r\n".encode())
+                self._send(f"PART {channel}")
 
     def format_message(self, msg: TwitchMessage) -> str:
         timestamp = datetime.datetime.fromtimestamp(msg.timestamp).strftime("%Y-%m-%d %H:%M:%S")
         return f"[{timestamp}] {msg.channel} - {msg.username}: {emoji.demojize(msg.message)}"
 
-    def _process_message(self, message: str):
+    def _process_message(self, message: str, received_at: Optional[float] = None) -> Optional[str]:
+        # Returns the formatted chat line, or None if the IRC line wasn't a chat message
         if message.startswith("PING"):
-            self.socket.send("PONG :tmi.twitch.tv\r\n".encode())
-            return
+            self._send("PONG :tmi.twitch.tv")
+            return None
 
         try:
-            # Extract username and channel from IRC message
-            if "PRIVMSG" not in message:
-                return
-
-            username_part = message.split('!', 1)[0][1:]
-            channel = message.split('PRIVMSG', 1)[1].split(':', 1)[0].strip()
-            msg_content = message.split('PRIVMSG', 1)[1].split(':', 1)[1].strip()
-
-            twitch_message = TwitchMessage(
-                channel=channel,
-                username=username_part,
-                message=msg_content,
-                timestamp=time.time()
-            )
+            twitch_message = parse_message(message, received_at)
+            if twitch_message is None:
+                return None
 
             # Format the message once for both console and file
             formatted_message = self.format_message(twitch_message)
 
             # Log to file if enabled
-            if self.logging_enabled and self.log_file:
+            log_file = self.log_file
+            if self.logging_enabled and log_file:
                 # remove the #channel from the message
-                formatted_message = formatted_message.replace(f"{twitch_message.channel} - ", "")
-                self.log_file.write(formatted_message + "\n")
-                self.log_file.flush()
+                log_file.write(formatted_message.replace(f"{twitch_message.channel} - ", "") + "\n")
 
-            # Print to console
-            print(formatted_message)
+            return formatted_message
 
         except Exception as e:
             print(f"[Error] Processing message: {e}")
+            return None
+
+    def _process_lines(self, lines: List[str]) -> int:
+        # Handles every complete line from one read, and prints the chat from it in one go. Returns the number of chat messages
+        formatted_messages = []
+        received_at = time.time()
+        for line in lines:
+            if line:
+                formatted_message = self._process_message(line, received_at)
+                if formatted_message is not None:
+                    formatted_messages.append(formatted_message)
+        if self.echo and formatted_messages:
+            print("\n".join(formatted_messages))
+        return len(formatted_messages)
 
-    def _read_messages(self):
-        buffer = ""
+    async def _read_messages(self, reader: asyncio.StreamReader):
+        buffer = b""
         while self.running:
             try:
-                new_data = self.socket.recv(2048).decode('utf-8', errors='ignore')
-                if not new_data:
-                    if self.running:
-                        print("[Warning] Lost connection, attempting to reconnect...")
-                        self.socket.close()
-                        self.socket = socket.socket()
-                        if self.connect():
-                            for channel in self.channels:
-                                self.join_channel(channel)
-                    continue
-
-                buffer += new_data
-                messages = buffer.split("\r\n")
-                buffer = messages.pop()
-
-                for message in messages:
-                    if message:
-                        self._process_message(message)
+                new_data = await asyncio.wait_for(reader.read(65536), timeout=1.0)
+            except asyncio.TimeoutError:
+                # Quiet chat, still make sure buffered log lines don't wait too long
+                self._flush_log_if_due()
+                continue
+            if not new_data:
+                raise ConnectionError("Connection closed by the server")
+
+            buffer += new_data
+            lines = buffer.split(b"\r\n")
+            buffer = lines.pop()
+            self._process_lines([line.decode('utf-8', errors='ignore') for line in lines])
+            self._flush_log_if_due()
+            await self.writer.drain()
 
+    def _flush_log_if_due(self):
+        log_file = self.log_file
+        if log_file:
+            log_file.flush_if_due()
+
+    async def _run(self):
+        self.loop = asyncio.get_running_loop()
+        reconnect_delay = self.min_reconnect_delay
+        while self.running:
+            try:
+                reader = await self._connect()
+                reconnect_delay = self.min_reconnect_delay
+                await self._read_messages(reader)
             except Exception as e:
-                print(f"[Error] Reading messages: {e}")
                 if not self.running:
                     break
-                time.sleep(1)
+                print(f"[Warning] Lost connection ({e}), reconnecting in {reconnect_delay:.1f}s...")
+                await asyncio.sleep(reconnect_delay)
+                reconnect_delay = min(reconnect_delay * 2, self.max_reconnect_delay)
+            finally:
+                if self.writer is not None:
+                    self.writer.close()
+                    self.writer = None
 
     def _keyboard_handler(self):
         keyboard.on_press_key('l', lambda _: self.toggle_logging())
@@ -152,18 +254,12 @@ class TwitchChatViewer:
             print("[Error] No channels specified. Please add channels before starting.")
             return False
 
-        if not self.connect():
-            return False
-
-        print("[System] Joining channels...")
-        # Join all channels
-        for channel in self.channels:
-            self.join_channel(channel)
+        self.running = True
 
-        # Start message reading thread
-        thread = threading.Thread(target=self._read_messages)
-        thread.daemon = True
-        thread.start()
+        # Start message reading thread, which runs the asyncio loop for the connection
+        self.loop_thread = threading.Thread(target=asyncio.run, args=(self._run(),))
+        self.loop_thread.daemon = True
+        self.loop_thread.start()
 
         # Start keyboard handler thread
         keyboard_thread = threading.Thread(target=self._keyboard_handler)
@@ -181,19 +277,55 @@ class TwitchChatViewer:
         self.running = False
         if self.log_file:
             self.log_file.close()
-        self.socket.close()
         sys.exit(0)
-        
-        
+
+
+def bench_replay(capture_path: str, chunk_size: int = 65536):
+    """
+    Replays a recorded IRC capture (raw lines as received from Twitch) through the message handling and log writer,
+    and reports how many chat messages per second it gets through. Nothing is printed per message.
+    """
+    import tempfile
+
+    with open(capture_path, "rb") as file:
+        capture = file.read()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        viewer = TwitchChatViewer(echo=False)
+        viewer.logs_dir = temp_dir
+        viewer.logging_enabled = True
+        viewer.log_file = BufferedLogWriter(open(os.path.join(temp_dir, "bench.log"), "a", encoding="utf-8"))
+
+        start_time = time.perf_counter()
+        buffer = b""
+        message_count = 0
+        # Feed the capture in the same sized reads the live reader uses
+        for position in range(0, len(capture), chunk_size):
+            buffer += capture[position:position + chunk_size]
+            lines = buffer.split(b"\r\n")
+            buffer = lines.pop()
+            message_count += viewer._process_lines([line.decode('utf-8', errors='ignore') for line in lines])
+            viewer.log_file.flush_if_due()
+        viewer.log_file.close()
+        elapsed = time.perf_counter() - start_time
+
+    print(f"[Bench] {message_count} messages in {elapsed:.3f}s ({message_count / max(elapsed, 1e-9):,.0f} msgs/sec)")
+    return message_count / max(elapsed, 1e-9)
+
+
 if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--bench-replay":
+        bench_replay(sys.argv[2])
+        sys.exit(0)
+
     # Create viewer instance
     viewer = TwitchChatViewer()
-    
+
     # Add channels to monitor (replace these with actual channels you want to monitor)
     # viewer.join_channel("fliberjig1official")  # Example channel
     # viewer.join_channel("im_so_twitch")  # Example channel
     viewer.join_channel("theliveitup34official")  # Example channel
-    
+
     # Start the viewer
     if viewer.start():
         # Keep the main thread running
@@ -204,4 +336,4 @@ if __name__ == "__main__":
                 viewer.stop()
     else:
         print("[Error] Failed to start viewer")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
@@ -0,0 +1,237 @@
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+# IRCv3 tag values escape these characters (https://ircv3.net/specs/extensions/message-tags)
+TAG_ESCAPES = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+
+class TwitchMessage:
+    """
+    A chat message from Twitch IRC. Uses __slots__, since the chat viewer creates one for every message.
+
+    The tags can be given as the raw tag text, which is only parsed (along with the badges, emotes, ids and display
+    name that come from it) if someone asks for them. Most messages only ever get logged, so that's never.
+    """
+
+    __slots__ = ("channel", "username", "message", "timestamp", "_display_name", "_user_id", "_message_id", "_badges", "_emotes", "_tags")
+
+    def __init__(self, channel: str, username: str, message: str, timestamp: float, user_id: Optional[str] = None,
+                 message_id: Optional[str] = None, badges: Optional[Dict[str, str]] = None,
+                 emotes: Union[List[Tuple[str, int, int]], str, None] = None, tags: Union[Dict[str, str], str, None] = None,
+                 display_name: Optional[str] = None):
+        self.channel = channel
+        self.username = username # The login name, which is what @mentions use
+        self.message = message
+        self.timestamp = timestamp # Server side send time when the tags have it (tmi-sent-ts), otherwise when we received it
+        # Anything not given here is looked up in the tags when it's asked for
+        self._display_name = display_name
+        self._user_id = user_id
+        self._message_id = message_id
+        self._badges = badges
+        self._emotes = emotes
+        # Either the parsed tags or the raw tag text
+        self._tags = tags if tags is not None else {}
+
+    @property
+    def tags(self) -> Dict[str, str]:
+        if isinstance(self._tags, str):
+            self._tags = parse_tags(self._tags)
+        return self._tags
+
+    @property
+    def display_name(self) -> str:
+        """How the name is shown in chat (capitalization, or a localized name)"""
+        return self._display_name or self.tags.get("display-name") or self.username
+
+    @property
+    def user_id(self) -> Optional[str]:
+        return self._user_id if self._user_id is not None else self.tags.get("user-id")
+
+    @property
+    def message_id(self) -> Optional[str]:
+        return self._message_id if self._message_id is not None else self.tags.get("id")
+
+    @property
+    def badges(self) -> Dict[str, str]:
+        """Badge name -> version, e.g. {"subscriber": "12"}"""
+        if self._badges is None:
+            self._badges = parse_badges(self.tags.get("badges", ""))
+        return self._badges
+
+    @property
+    def emotes(self) -> List[Tuple[str, int, int]]:
+        """(emote id, first character, last character) for every emote in the message"""
+        if self._emotes is None:
+            self._emotes = self.tags.get("emotes", "")
+        if isinstance(self._emotes, str):
+            self._emotes = parse_emotes(self._emotes)
+        return self._emotes
+
+    def __repr__(self):
+        return f"TwitchMessage(channel={self.channel!r}, username={self.username!r}, message={self.message!r}, timestamp={self.timestamp!r})"
+
+
+def _unescape_tag(value: str) -> str:
+    if "\\" not in value:
+        return value
+    result = []
+    index = 0
+    while index < len(value):
+        character = value[index]
+        if character == "\\" and index + 1 < len(value):
+            result.append(TAG_ESCAPES.get(value[index + 1], value[index + 1]))
+            index += 2
+            continue
+        if character != "\\":
+            result.append(character)
+        index += 1
+    return "".join(result)
+
+
+def parse_tags(tags_text: str) -> Dict[str, str]:
+    tags = {}
+    for tag in tags_text.split(";"):
+        key, _, value = tag.partition("=")
+        tags[key] = value
+    if "\\" in tags_text:
+        # Escapes are rare, so only pay for unescaping when there are any
+        tags = {key: _unescape_tag(value) for key, value in tags.items()}
+    return tags
+
+
+def find_tag(tags_text: str, key: str) -> Optional[str]:
+    """Returns one tag's value straight from the raw tag text, without parsing the rest, or None if it isn't there"""
+    prefix = key + "="
+    if tags_text.startswith(prefix):
+        start = len(prefix)
+    else:
+        start = tags_text.find(";" + prefix)
+        if start < 0:
+            return None
+        start += len(prefix) + 1
+    end = tags_text.find(";", start)
+    return _unescape_tag(tags_text[start:] if end < 0 else tags_text[start:end])
+
+
+def parse_badges(badges_text: str) -> Dict[str, str]:
+    badges = {}
+    if badges_text:
+        for badge in badges_text.split(","):
+            name, _, version = badge.partition("/")
+            badges[name] = version
+    return badges
+
+
+def parse_emotes(emotes_text: str) -> List[Tuple[str, int, int]]:
+    # "25:0-4,12-16/1902:6-10" -> [("25", 0, 4), ("25", 12, 16), ("1902", 6, 10)]
+    emotes = []
+    if emotes_text:
+        for emote in emotes_text.split("/"):
+            emote_id, _, positions = emote.partition(":")
+            for position in positions.split(","):
+                start, _, end = position.partition("-")
+                if start and end:
+                    emotes.append((emote_id, int(start), int(end)))
+    return emotes
+
+
+def parse_message(line: str, received_at: Optional[float] = None) -> Optional[TwitchMessage]:
+    """
+    Parse one raw IRC line in a single pass over it.
+
+    Handles the optional IRCv3 tag prefix (@key=value;...), the source prefix and /me actions.
+    Only the send time is read from the tags here, the rest are parsed if the message's tags are ever asked for.
+
+    Returns:
+        TwitchMessage: The chat message, or None if the line isn't a PRIVMSG
+    """
+    tags_text = None
+    if line.startswith("@"):
+        tags_text, _, line = line.partition(" ")
+        tags_text = tags_text[1:]
+
+    # One split gives source, command, channel and text (IRC separates them with single spaces)
+    if line.startswith(":"):
+        parts = line.split(" ", 3)
+        if len(parts) < 4:
+            return None
+        source, command, channel, text = parts
+        # The source is nick!user@host, the username is the nick
+        nick_end = source.find("!")
+        username = source[1:nick_end] if nick_end >= 0 else source[1:]
+    else:
+        parts = line.split(" ", 2)
+        if len(parts) < 3:
+            return None
+        command, channel, text = parts
+        username = ""
+    if command != "PRIVMSG" or not text.startswith(":"):
+        return None
+    text = text[1:]
+    if text.startswith("\x01ACTION ") and text.endswith("\x01"):
+        text = text[8:-1]
+
+    timestamp = received_at if received_at is not None else time.time()
+    if not tags_text:
+        return TwitchMessage(channel, username, text.strip(), timestamp)
+
+    sent_at = find_tag(tags_text, "tmi-sent-ts")
+    if sent_at:
+        try:
+            timestamp = int(sent_at) / 1000
+        except ValueError:
+            # A broken timestamp isn't worth losing the message over
+            pass
+    return TwitchMessage(channel, username, text.strip(), timestamp, tags=tags_text)
+
+
+def bench_parser(count: int = 200000):
+    """
+    Parse the same synthetic corpus (tagged, and the same lines without tags) with parse_message and with the old split
+    based parsing, and print lines/sec for each. Also times parse_message when the tags and badges are read afterwards,
+    which is what a consumer that needs them pays.
+    """
+    import random
+
+    random.seed(0)
+    lines = []
+    for index in range(count):
+        user = f"chatter{random.randint(0, 2000)}"
+        lines.append(
+            f"@badge-info=subscriber/{index % 24};badges=subscriber/12,premium/1;color=#1E90FF;display-name={user};"
+            f"emotes=25:0-4,12-16/1902:6-10;first-msg=0;flags=;id=msg-{index};mod=0;room-id=1234;subscriber=1;"
+            f"tmi-sent-ts={1700000000000 + index};turbo=0;user-id={index % 2000};user-type= "
+            f":{user}!{user}@{user}.tmi.twitch.tv PRIVMSG #channel :Kappa Keepo Kappa message number {index}"
+        )
+
+    # The same messages without tags, as they arrive when the tags capability isn't requested
+    untagged_lines = [line.split(" ", 1)[1] for line in lines]
+
+    def time_parser(parse, corpus):
+        start_time = time.perf_counter()
+        for line in corpus:
+            parse(line)
+        return len(corpus) / (time.perf_counter() - start_time)
+
+    def split_parse(line):
+        # What TwitchChatViewer._process_message used to do (it gets the username wrong for tagged lines)
+        if "PRIVMSG" in line:
+            username = line.split('!', 1)[0][1:]
+            channel = line.split('PRIVMSG', 1)[1].split(':', 1)[0].strip()
+            message = line.split('PRIVMSG', 1)[1].split(':', 1)[1].strip()
+            return TwitchMessage(channel=channel, username=username, message=message, timestamp=time.time())
+
+    def parse_and_read_tags(line):
+        message = parse_message(line)
+        message.badges
+        message.user_id
+        return message
+
+    print(f"[Bench] {count} synthetic messages")
+    for name, corpus in (("tagged", lines), ("untagged", untagged_lines)):
+        print(f"[Bench] {name}: split parsing {time_parser(split_parse, corpus):,.0f} lines/sec, "
+              f"parse_message {time_parser(parse_message, corpus):,.0f} lines/sec")
+    print(f"[Bench] tagged, parse_message then reading the badges and user id: {time_parser(parse_and_read_tags, lines):,.0f} lines/sec")
+
+if __name__ == "__main__":
+    bench_parser()
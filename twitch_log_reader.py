@@ -0,0 +1,110 @@
+import json
+import os
+from typing import Callable, List, Optional
+
+from atomic_file import write_atomic
+from token_budget import estimate_tokens
+
+# Written by TwitchChatViewer whenever it starts a new log, so finding the current log doesn't need a directory scan
+CURRENT_LOG_MANIFEST = "current.json"
+
+
+def write_current_log(logs_dir: str, log_name: str, active: bool = True):
+    """Point the manifest at log_name. Written atomically, so a reader never sees a half written manifest"""
+    write_atomic(os.path.join(logs_dir, CURRENT_LOG_MANIFEST), json.dumps({"log": log_name, "active": active}))
+
+
+def find_current_log(logs_dir: str = "twitch_logs") -> Optional[str]:
+    """
+    Returns the path of the log the chat viewer is (or was last) writing to, or None if there are no logs.
+    Uses the manifest, and only falls back to scanning the folder if the manifest is missing or out of date.
+    """
+    try:
+        with open(os.path.join(logs_dir, CURRENT_LOG_MANIFEST), 'r') as file:
+            log_path = os.path.join(logs_dir, json.load(file)["log"])
+        if os.path.exists(log_path):
+            return log_path
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    if not os.path.isdir(logs_dir):
+        return None
+    # Log names start with their creation time, so the newest log sorts last
+    log_names = sorted(name for name in os.listdir(logs_dir) if name.endswith(".log"))
+    if not log_names:
+        return None
+    return os.path.join(logs_dir, log_names[-1])
+
+
+class TwitchLogReader:
+    """
+    Reads Twitch chat logs incrementally.
+
+    The reader remembers how far into each log file it has read, so each chat summary only sends the lines
+    that were logged since the previous one. The batch is also capped at max_tokens: if chat moved faster
+    than that, only the newest lines are kept, so a summary costs about the same however long the stream runs.
+    """
+
+    def __init__(self, max_tokens: int = 1500, count_tokens: Callable[[str], int] = estimate_tokens, state_file: Optional[str] = os.path.join("twitch_logs", "read_offsets.json")):
+        """
+        Args:
+            max_tokens (int, optional): Most tokens of chat returned by one read_new call
+            count_tokens (function, optional): Counts the tokens of a piece of text
+            state_file (str, optional): JSON file the read offsets are kept in, so a restart doesn't resend old chat. None keeps them in memory only
+        """
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens
+        self.state_file = state_file
+        self.offsets = {}
+        if self.state_file and os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, 'r') as file:
+                    self.offsets = json.load(file)
+            except ValueError:
+                self.offsets = {}
+
+    def read_new_lines(self, log_path: str) -> List[str]:
+        """
+        Returns the complete lines added to log_path since the last call, newest last, within the token cap.
+        A line that's still being written is left for the next call.
+        """
+        key = os.path.abspath(log_path)
+        offset = self.offsets.get(key, 0)
+        if os.path.getsize(log_path) < offset:
+            # The file was truncated or replaced, start over
+            offset = 0
+        with open(log_path, "rb") as file:
+            file.seek(offset)
+            data = file.read()
+
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            return []
+        self.offsets[key] = offset + end
+        # Forget logs that were rotated out
+        self.offsets = {path: position for path, position in self.offsets.items() if os.path.exists(path)}
+        self._save_offsets()
+
+        lines = [line for line in data[:end].decode("utf-8", errors="ignore").splitlines() if line.strip()]
+        # Keep the newest lines that fit in the budget, chat that's older than that is skipped
+        kept = []
+        total_tokens = 0
+        for line in reversed(lines):
+            line_tokens = self.count_tokens(line)
+            if kept and total_tokens + line_tokens > self.max_tokens:
+                break
+            kept.append(line)
+            total_tokens += line_tokens
+        kept.reverse()
+        if len(kept) < len(lines):
+            print(f"Skipped {len(lines) - len(kept)} older chat lines to stay under {self.max_tokens} tokens")
+        return kept
+
+    def read_new(self, log_path: str) -> str:
+        """Same as read_new_lines, joined into one string"""
+        return "\n".join(self.read_new_lines(log_path))
+
+    def _save_offsets(self):
+        if not self.state_file:
+            return
+        write_atomic(self.state_file, json.dumps(self.offsets))
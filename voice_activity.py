@@ -0,0 +1,96 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+class EnergyVAD:
+    """
+    Simple energy-based voice activity detector for microphone frames.
+
+    Frames are fed in one at a time as they're read from PyAudio. Whenever the speaker pauses long enough,
+    the span of the speech since the last pause is handed back as a finished segment, so it can be transcribed
+    while the user is still talking. The detector only marks where segments start and end (as frame numbers,
+    counted from the first frame fed); the audio itself stays in the recorder's AudioRingBuffer.
+    The speech threshold follows the background noise level, so it works without per-mic tuning.
+    """
+
+    def __init__(self, rate: int, frame_samples: int, min_threshold: float = 300.0, noise_ratio: float = 3.0,
+                 min_silence: float = 0.5, min_speech: float = 0.25, pre_roll: float = 0.3, max_segment: float = 25.0):
+        """
+        Args:
+            rate (int): Sample rate of the frames
+            frame_samples (int): Number of samples (per channel) in each frame
+            min_threshold (float, optional): Lowest RMS level (int16 scale) that can count as speech
+            noise_ratio (float, optional): Speech has to be this many times louder than the background noise
+            min_silence (float, optional): Seconds of quiet that end a segment
+            min_speech (float, optional): Segments with less speech than this (in seconds) are dropped as noise
+            pre_roll (float, optional): Seconds of audio kept from before speech starts, so first syllables aren't cut off
+            max_segment (float, optional): Segments are cut at this length (Whisper works on 30 second windows)
+        """
+        frame_seconds = frame_samples / rate
+        self.min_threshold = min_threshold
+        self.noise_ratio = noise_ratio
+        self.silence_frames = max(1, int(min_silence / frame_seconds))
+        self.min_speech_frames = max(1, int(min_speech / frame_seconds))
+        self.max_segment_frames = max(1, int(max_segment / frame_seconds))
+        self.pre_roll_frames = max(1, int(pre_roll / frame_seconds))
+        self.noise_level = min_threshold / noise_ratio
+        self.frames = 0 # Frames fed so far
+        self.segment_start: Optional[int] = None # First frame of the segment in progress, None between segments
+        self.last_end = 0 # End of the last segment, pre-roll never reaches back past it
+        self.speech_frames = 0
+        self.quiet_frames = 0
+
+    @property
+    def keep_from(self) -> int:
+        """First frame that could still end up in a segment. Audio from before it can be thrown away"""
+        if self.segment_start is not None:
+            return self.segment_start
+        return max(self.last_end, self.frames - self.pre_roll_frames)
+
+    def process(self, frame: np.ndarray) -> Optional[Tuple[int, int]]:
+        """
+        Feed one mono frame.
+
+        Args:
+            frame (np.ndarray): Mono samples on the int16 scale
+
+        Returns:
+            tuple: The (start, end) frame numbers of a finished speech segment if this frame ended one, otherwise None
+        """
+        level = float(np.sqrt(np.mean(np.square(frame, dtype=np.float64)))) if len(frame) else 0.0
+        is_speech = level > max(self.min_threshold, self.noise_level * self.noise_ratio)
+
+        if self.segment_start is None:
+            if is_speech:
+                # Speech started, include the audio from just before it
+                self.segment_start = self.keep_from
+                self.speech_frames = 1
+                self.quiet_frames = 0
+            else:
+                # Slowly follow the background noise level while nobody is talking
+                self.noise_level = 0.95 * self.noise_level + 0.05 * level
+            self.frames += 1
+            return None
+
+        self.frames += 1
+        if is_speech:
+            self.speech_frames += 1
+            self.quiet_frames = 0
+        else:
+            self.quiet_frames += 1
+        if self.quiet_frames >= self.silence_frames or self.frames - self.segment_start >= self.max_segment_frames:
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[Tuple[int, int]]:
+        """Returns the span of the segment in progress (if it has enough speech in it) and starts over"""
+        segment = None
+        if self.segment_start is not None:
+            if self.speech_frames >= self.min_speech_frames:
+                segment = (self.segment_start, self.frames)
+            self.last_end = self.frames
+        self.segment_start = None
+        self.speech_frames = 0
+        self.quiet_frames = 0
+        return segment
@@ -0,0 +1,66 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from atomic_file import write_atomic
+
+
+class VoiceCatalog:
+    """
+    On-disk copy of the Elevenlabs voice list (name -> voice id) and each voice's settings.
+
+    Loading the catalog lets the app start without asking Elevenlabs for every voice and its settings first.
+    It still works when the API can't be reached, and it avoids a blocking round-trip in the middle of an agent's first turn.
+    The catalog counts as stale after ttl seconds. Callers keep using stale data and refresh it in the background.
+    """
+
+    def __init__(self, path="voice_catalog.json", ttl=24 * 60 * 60):
+        """
+        Args:
+            path (str, optional): JSON file the catalog is stored in
+            ttl (int, optional): Seconds after which the catalog should be refreshed from the API
+        """
+        self.path = path
+        self.ttl = ttl
+        self.voice_to_id: Dict[str, str] = {}
+        self.settings: Dict[str, dict] = {} # Keyed by voice id
+        self.updated_at = 0.0
+        self._lock = threading.Lock()
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as file:
+                    data = json.load(file)
+                self.voice_to_id = data.get("voices", {})
+                self.settings = data.get("settings", {})
+                self.updated_at = data.get("updated_at", 0.0)
+            except ValueError:
+                # A broken catalog is just fetched again
+                print(f"Voice catalog {self.path} is corrupted, fetching the voices again")
+
+    def is_empty(self) -> bool:
+        return not self.voice_to_id
+
+    def is_stale(self) -> bool:
+        return time.time() - self.updated_at > self.ttl
+
+    def get_settings(self, voice_id: str) -> Optional[dict]:
+        with self._lock:
+            return self.settings.get(voice_id)
+
+    def set_voices(self, voice_to_id: Dict[str, str]):
+        """Replace the voice list with a fresh one from the API"""
+        with self._lock:
+            self.voice_to_id = dict(voice_to_id)
+            self.updated_at = time.time()
+            self._save()
+
+    def set_settings(self, voice_id: str, settings: dict):
+        with self._lock:
+            self.settings[voice_id] = settings
+            self._save()
+
+    def _save(self):
+        write_atomic(self.path, json.dumps({"updated_at": self.updated_at, "voices": self.voice_to_id, "settings": self.settings}))
@@ -1,7 +1,19 @@
-import torch
-from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline
 from rich import print
+import threading
+import queue
 import time
+import numpy as np
+
+# Model sizes that can be picked by name. Smaller models load and run much faster, especially on CPU, at some cost in accuracy.
+# Any other value is used as a HuggingFace model id as-is.
+WHISPER_MODELS = {
+    "tiny": "openai/whisper-tiny",
+    "base": "openai/whisper-base",
+    "small": "openai/whisper-small",
+    "medium": "openai/whisper-medium",
+    "large-v3": "openai/whisper-large-v3",
+    "large-v3-turbo": "openai/whisper-large-v3-turbo",
+}
 
 class WhisperManager():
 
@@ -9,39 +21,110 @@ class WhisperManager():
     # Need to make sure you've installed torch with CUDA support, rather than just default torch: pip install torch torchvision torchaudio --index-url https://download.pytorch.org/whl/cu118
     # I tried a lot but could not get Flash Attention 2 to install. It would speed up performance but isn't necessary.
 
-    def __init__(self):
-        print(torch.cuda.is_available())  # Should return True if CUDA is available
-        print(torch.cuda.get_device_name(0))  # Should return the name of your GPU, e.g., "NVIDIA GeForce RTX 4070 Ti"
-        device = "cuda:0" if torch.cuda.is_available() else "cpu"
-        torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
-        model_id = "openai/whisper-large-v3"
-
-        model = AutoModelForSpeechSeq2Seq.from_pretrained(
-            model_id, torch_dtype=torch_dtype, low_cpu_mem_usage=True, use_safetensors=True
-        )
-        model.to(device)
-        model.generation_config.is_multilingual = False
-        model.generation_config.language = "en"
-
-        processor = AutoProcessor.from_pretrained(model_id)
-
-        self.pipe = pipeline(
-            "automatic-speech-recognition",
-            model=model,
-            tokenizer=processor.tokenizer,
-            feature_extractor=processor.feature_extractor,
-            max_new_tokens=256,
-            chunk_length_s=30,
-            batch_size=16,
-            return_timestamps=True,
-            torch_dtype=torch_dtype,
-            device=device,
-        )
+    # The model is loaded lazily, the first time it's needed (or when load_in_background is called), so creating a WhisperManager is instant.
+    # model_size: one of WHISPER_MODELS or a HuggingFace model id
+    # dtype: "auto" (float16 on GPU, float32 on CPU), "float16", "float32", or "int8" (dynamically quantized, CPU only)
+    def __init__(self, model_size="large-v3", dtype="auto", lazy=True):
+        self.model_id = WHISPER_MODELS.get(model_size, model_size)
+        self.dtype = dtype
+        self.pipe = None
+        self.ready = threading.Event() # Set once the model is loaded and audio_to_text won't block
+        self.load_finished = threading.Event() # Set once loading has either succeeded or failed
+        self.load_error = None
+        self._load_lock = threading.Lock() # Held for the whole load
+        self._start_lock = threading.Lock() # Only guards starting the background load, so it never waits on a load in progress
+        self._load_thread = None
+        if not lazy:
+            self.load()
+
+    # Start loading the model on a background thread, if it isn't loaded or loading already. Never blocks
+    def load_in_background(self):
+        with self._start_lock:
+            if self._load_thread is not None or self.load_finished.is_set() or self._load_lock.locked():
+                return
+            self._load_thread = threading.Thread(target=self._load_quietly, daemon=True)
+            self._load_thread.start()
+
+    # Wait for the model to finish loading (starting the load if needed). Returns True if it's ready, False if it failed or timed out
+    def wait_until_ready(self, timeout=None):
+        self.load_in_background()
+        self.load_finished.wait(timeout)
+        return self.ready.is_set()
+
+    def _load_quietly(self):
+        try:
+            self.load()
+        except Exception as e:
+            print(f"[red]Could not load Whisper model {self.model_id}: {str(e)}")
+
+    def load(self):
+        with self._load_lock:
+            if self.pipe is not None:
+                return
+            try:
+                start_time = time.time()
+                # Imported here because torch and transformers alone take seconds to import
+                import torch
+                from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline
+
+                use_cuda = torch.cuda.is_available()
+                if use_cuda:
+                    print(f"[green]Whisper is using {torch.cuda.get_device_name(0)}")  # e.g., "NVIDIA GeForce RTX 4070 Ti"
+                else:
+                    print("[yellow]CUDA isn't available, Whisper is running on the CPU")
+                device = "cuda:0" if use_cuda else "cpu"
+                quantize = self.dtype == "int8" and not use_cuda
+                if self.dtype == "int8" and use_cuda:
+                    print("[yellow]int8 Whisper is only supported on the CPU, using float16 on the GPU instead")
+                if self.dtype == "float16" or (self.dtype in ("auto", "int8") and use_cuda):
+                    torch_dtype = torch.float16
+                else:
+                    torch_dtype = torch.float32
+
+                model = AutoModelForSpeechSeq2Seq.from_pretrained(
+                    self.model_id, torch_dtype=torch_dtype, low_cpu_mem_usage=True, use_safetensors=True
+                )
+                if quantize:
+                    # Dynamic int8 quantization of the linear layers, roughly halves CPU inference time
+                    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+                model.to(device)
+                model.generation_config.is_multilingual = False
+                model.generation_config.language = "en"
+
+                processor = AutoProcessor.from_pretrained(self.model_id)
+
+                self.pipe = pipeline(
+                    "automatic-speech-recognition",
+                    model=model,
+                    tokenizer=processor.tokenizer,
+                    feature_extractor=processor.feature_extractor,
+                    max_new_tokens=256,
+                    chunk_length_s=30,
+                    batch_size=16,
+                    return_timestamps=True,
+                    torch_dtype=torch_dtype,
+                    device=device,
+                )
+                self.ready.set()
+                print(f"[green]Loaded Whisper model {self.model_id} in {time.time() - start_time:.1f} seconds")
+            except Exception as e:
+                self.load_error = e
+                raise
+            finally:
+                self.load_finished.set()
     
-    # Converts an audio file into transcribed text. Can provide also provide timestamps
+    # Converts an audio file (or a 16 kHz mono float32 numpy array) into transcribed text. Can provide also provide timestamps
     # wav and mp3 files appear to take the same amount of time to process
     # With test files, word timestamps took 3.5-4 seconds, sentence timestamps took 2.2 seconds, no timestamps took 1.9-2 seconds
+    # If loading the model already failed this raises straight away instead of trying the whole multi-second load again
     def audio_to_text(self, audio_file, timestamps=None):
+        if self.pipe is None:
+            if self.load_error is not None:
+                raise RuntimeError(f"Whisper model {self.model_id} failed to load: {str(self.load_error)}") from self.load_error
+            self.load()
+        if isinstance(audio_file, np.ndarray):
+            # In-memory audio from AudioManager.record_audio is already 16 kHz mono float32, so Whisper can use it as is
+            audio_file = {"raw": audio_file, "sampling_rate": 16000}
         if timestamps == None:
             result = self.pipe(audio_file, return_timestamps=False)
         elif timestamps == "sentence":
@@ -67,3 +150,46 @@ class WhisperManager():
                 timestamped_chunks.append(new_chunk)
             return timestamped_chunks
 
+
+
+class StreamingTranscriber():
+
+    # Transcribes speech segments on a background thread as they come in from AudioManager.record_audio_streaming,
+    # so by the time the user lets go of the record key only the last segment still needs to be transcribed.
+    # Usage: pass add_segment as the on_segment callback, then call finish() after recording to get the full transcript.
+    def __init__(self, whisper_manager):
+        self.whisper_manager = whisper_manager
+        self.segments = queue.Queue()
+        self.transcripts = []
+        self.worker = threading.Thread(target=self._transcribe_segments, daemon=True)
+        self.worker.start()
+
+    def add_segment(self, samples, rate):
+        self.segments.put((samples, rate))
+
+    def _transcribe_segments(self):
+        while True:
+            segment = self.segments.get()
+            if segment is None:
+                break
+            samples, rate = segment
+            try:
+                text = self.whisper_manager.audio_to_text({"raw": samples, "sampling_rate": rate})
+                self.transcripts.append(text.strip())
+            except Exception as e:
+                print(f"[red]Error transcribing speech segment: {str(e)}")
+
+    # Waits for the remaining segments to be transcribed and returns the whole transcript
+    def finish(self):
+        self.segments.put(None)
+        self.worker.join()
+        return " ".join(text for text in self.transcripts if text)
+
+    # Drops any segments that haven't been transcribed yet and stops the worker
+    def discard(self):
+        while not self.segments.empty():
+            try:
+                self.segments.get_nowait()
+            except queue.Empty:
+                break
+        self.segments.put(None)